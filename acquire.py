@@ -0,0 +1,52 @@
+# acquire.py --
+#   concurrent polling of the gas analysers (tcp) and the gas counters (rs485)
+
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import metrics
+
+
+class Acquisition:
+    """Reads all analysers and all counter buses at the same time, so a full
+    read takes as long as the slowest device or bus rather than the sum of
+    all of them. Counters on the same serial bus are read one at a time.
+
+    `buses` is a list of lists of counters; the snapshots are returned in
+    that order, flattened, i.e. one per reactor."""
+
+    def __init__(self, analysers, buses):
+        self.analysers = analysers
+        self.buses = buses
+        self.bus_locks = [threading.Lock() for _ in buses]
+        self.pool = ThreadPoolExecutor(
+            max_workers=len(analysers) + len(buses), thread_name_prefix="acquire"
+        )
+
+    def read_bus(self, i):
+        with self.bus_locks[i], metrics.timer("bus_read_seconds", bus=i):
+            return [counter.read_snapshot() for counter in self.buses[i]]
+
+    def read_counters(self):
+        """Returns a list of CounterSnapshots, one per counter."""
+        if len(self.buses) == 1:
+            return self.read_bus(0)
+        results = [self.pool.submit(self.read_bus, i) for i in range(len(self.buses))]
+        return [snap for result in results for snap in result.result()]
+
+    def read_gas(self):
+        """Returns a list of GasReadings, one per analyser."""
+        results = [self.pool.submit(analyser.read_gas) for analyser in self.analysers]
+        return [result.result() for result in results]
+
+    def read_all(self):
+        """Poll all devices concurrently. Returns (gas readings, counter snapshots)."""
+        gas = [self.pool.submit(analyser.read_gas) for analyser in self.analysers]
+        buses = [self.pool.submit(self.read_bus, i) for i in range(len(self.buses))]
+        return (
+            [result.result() for result in gas],
+            [snap for result in buses for snap in result.result()],
+        )
+
+    def close(self):
+        self.pool.shutdown(wait=True)
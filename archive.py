@@ -0,0 +1,197 @@
+# archive.py --
+#   moves cold sensordata out of sqlite into monthly columnar archive files
+#   (one compressed numpy array per column), and reads the archive and the
+#   live table together. run it from a timer (misc/gasmix-archive.timer).
+
+import os
+import sys
+import argparse
+from datetime import datetime, timezone
+
+import numpy as np
+
+import db
+
+ARCHIVE_DIR = os.environ.get("GASMIX_ARCHIVE_DIR", os.path.expanduser("~/gasferm-archive"))
+
+# rows older than this are archived
+ARCHIVE_DAYS = 180
+
+# column -> dtype of the archive arrays. NULLs are stored as NaN
+COLUMNS = {
+    "id": np.int64,
+    "read_time": np.int64,
+    "reactor": np.int64,
+    "vol": np.float64,
+    "h2": np.float64,
+    "co2": np.float64,
+    "temp": np.float64,
+    "pressure": np.float64,
+    "humidity": np.float64,
+    "comment": np.str_,
+}
+
+parser = argparse.ArgumentParser()
+parser.add_argument(
+    "--days",
+    type=int,
+    default=ARCHIVE_DAYS,
+    help=f"Archive whole months of data older than this many days (default: {ARCHIVE_DAYS})",
+)
+parser.add_argument(
+    "--vacuum",
+    action="store_true",
+    help="Shrink the database file afterwards. This locks the database for a while, "
+    "so stop the logger first",
+)
+
+
+def month_start(timestamp):
+    """Unix time at the start of the (UTC) month of timestamp."""
+    d = datetime.fromtimestamp(timestamp, timezone.utc)
+    return int(datetime(d.year, d.month, 1, tzinfo=timezone.utc).timestamp())
+
+
+def next_month(start):
+    d = datetime.fromtimestamp(start, timezone.utc)
+    year, month = divmod(d.year * 12 + d.month, 12)  # d.month is 1-based
+    return int(datetime(year, month + 1, 1, tzinfo=timezone.utc).timestamp())
+
+
+def month_file(start):
+    d = datetime.fromtimestamp(start, timezone.utc)
+    return os.path.join(ARCHIVE_DIR, f"sensordata-{d.year:04d}-{d.month:02d}.npz")
+
+
+def months():
+    """Start times of the archived months, oldest first."""
+    if not os.path.isdir(ARCHIVE_DIR):
+        return []
+    starts = []
+    for name in os.listdir(ARCHIVE_DIR):
+        if name.startswith("sensordata-") and name.endswith(".npz"):
+            d = datetime.strptime(name[len("sensordata-") : -len(".npz")], "%Y-%m")
+            starts.append(int(d.replace(tzinfo=timezone.utc).timestamp()))
+    return sorted(starts)
+
+
+def load_month(start, columns=None):
+    """The archived arrays of a month, or None. np.load reads each array
+    lazily, so only the requested columns are read and decompressed."""
+    path = month_file(start)
+    if not os.path.exists(path):
+        return None
+    with np.load(path) as f:
+        return {col: f[col] for col in columns or COLUMNS}
+
+
+def write_month(start, arrays):
+    """Atomically (re)write a month's archive file, merging in any rows
+    already archived for that month."""
+    old = load_month(start)
+    if old is not None:
+        arrays = {col: np.concatenate([old[col], arrays[col]]) for col in COLUMNS}
+        # rows can be archived twice if an earlier run was interrupted before
+        # it deleted them from the database
+        _, first = np.unique(arrays["id"], return_index=True)
+        arrays = {col: a[first] for col, a in arrays.items()}
+    order = np.lexsort((arrays["reactor"], arrays["read_time"]))
+    arrays = {col: a[order] for col, a in arrays.items()}
+
+    os.makedirs(ARCHIVE_DIR, exist_ok=True)
+    path = month_file(start)
+    tmp = f"{path}.{os.getpid()}"
+    with open(tmp, "wb") as f:
+        np.savez_compressed(f, **arrays)
+    os.replace(tmp, path)
+
+
+def read_live(start, end):
+    """All rows of [start, end) from the database, as arrays."""
+    values = {col: [] for col in COLUMNS}
+    for columns, rows in db.iter_chunks(
+        "extract_data", start_timestamp=start, end_timestamp=end - 1
+    ):
+        for col, column in zip(columns, zip(*rows)):
+            values[col].extend(column)
+    return {
+        col: np.array(["" if v is None else v for v in values[col]], dtype=dtype)
+        if dtype is np.str_
+        else np.array(values[col], dtype=dtype)
+        for col, dtype in COLUMNS.items()
+    }
+
+
+def archive(days=ARCHIVE_DAYS, batch_size=10000):
+    """Archive all whole months older than `days`, then delete their rows from
+    the database in small batches. Returns the number of archived rows."""
+    cutoff = month_start(datetime.now(timezone.utc).timestamp() - days * 86400)
+    oldest = db.queries.get_oldest_read_time()
+    if oldest is None:
+        return 0
+
+    total = 0
+    start = month_start(oldest)
+    while start < cutoff:
+        end = next_month(start)
+        arrays = read_live(start, end)
+        if len(arrays["id"]):
+            print(f"Archiving {len(arrays['id'])} rows to {month_file(start)}", file=sys.stderr)
+            write_month(start, arrays)
+            max_id = int(arrays["id"].max())
+            while True:
+                with db.queries.transaction():
+                    deleted = db.queries.delete_archived(
+                        start_timestamp=start,
+                        end_timestamp=end,
+                        max_id=max_id,
+                        batch_size=batch_size,
+                    )
+                if deleted < batch_size:
+                    break
+            total += len(arrays["id"])
+        start = end
+    return total
+
+
+def iter_chunks(start_timestamp, end_timestamp, columns=None, chunk_size=5000, reactor=None):
+    """Like db.iter_chunks("extract_data", ...), but over the archive and the
+    live table together: yields (columns, rows) for all sensordata rows with
+    start_timestamp <= read_time <= end_timestamp, or only those of one
+    reactor. Only the months and columns that are needed are read from the
+    archive."""
+    columns = list(columns or COLUMNS)
+    for start in months():
+        if next_month(start) <= start_timestamp or start > end_timestamp:
+            continue
+        arrays = load_month(start, columns=set(columns) | {"read_time", "reactor"})
+        t = arrays["read_time"]
+        mask = (t >= start_timestamp) & (t <= end_timestamp)
+        if reactor is not None:
+            mask &= arrays["reactor"] == reactor
+        selected = [arrays[col][mask] for col in columns]
+        for i in range(0, mask.sum(), chunk_size):
+            yield columns, list(zip(*(a[i : i + chunk_size].tolist() for a in selected)))
+
+    name, params = "extract_data", dict(start_timestamp=start_timestamp, end_timestamp=end_timestamp)
+    if reactor is not None:
+        name, params = "extract_reactor_data", dict(params, reactor=reactor)
+    for live_columns, rows in db.iter_chunks(name, chunk_size, **params):
+        if columns != live_columns:
+            index = [live_columns.index(col) for col in columns]
+            rows = [tuple(row[i] for i in index) for row in rows]
+        yield columns, rows
+
+
+def main():
+    args = parser.parse_args()
+    db.init()
+    db.migrate()
+    print(f"Archived {archive(args.days)} rows.", file=sys.stderr)
+    if args.vacuum:
+        with db.queries.engine.connect() as conn:
+            conn.exec_driver_sql("VACUUM")
+
+
+if __name__ == "__main__":
+    main()
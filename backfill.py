@@ -0,0 +1,155 @@
+# backfill.py --
+#   bulk import of older sensordata, e.g. after downtime or a device swap,
+#   from tsv/csv files in the layout of the web app's raw export. rows whose
+#   (read_time, reactor) is already in the database (or the archive) are
+#   skipped. the rollups and the yield index are updated, and the rrds are
+#   rebuilt if any imported rows fall within their span.
+
+import os
+import sys
+import time
+import argparse
+
+import numpy as np
+import pandas as pd
+
+import db
+import rrd
+import yields
+import archive
+
+CHUNK_SIZE = 100000
+BATCH_SIZE = 10000
+
+# columns read from the files; others (id, site) are ignored
+COLUMNS = ["read_time", "reactor", "vol", "h2", "co2", "temp", "pressure", "humidity", "comment"]
+
+# (read_time, reactor) keys are compared as read_time * KEY_SPAN + reactor
+KEY_SPAN = 1024
+
+parser = argparse.ArgumentParser(description="Import sensordata from TSV/CSV files.")
+parser.add_argument("files", nargs="+", help="TSV or CSV files, optionally compressed (e.g. .tsv.gz)")
+parser.add_argument("--sep", default=None, help="Column separator (default: comma for .csv files, tab otherwise)")
+parser.add_argument(
+    "--tz",
+    default="UTC",
+    help="Time zone of read_time when it is a date and time rather than a Unix time (default: UTC, as in exports)",
+)
+parser.add_argument(
+    "--chunk-size", type=int, default=CHUNK_SIZE, help=f"Rows read at a time (default: {CHUNK_SIZE})"
+)
+parser.add_argument("--no-rrd", action="store_true", help="Do not rebuild the RRD files")
+
+
+def unix_times(column, tz):
+    """read_time as float Unix times, NaN where it cannot be parsed. Numbers
+    are taken as Unix times, dates and times as local times in `tz`."""
+    numbers = pd.to_numeric(column, errors="coerce")
+    if numbers.notna().any():
+        return numbers
+    t = pd.to_datetime(column, format="ISO8601", errors="coerce")
+    t = t.dt.tz_localize(tz, ambiguous="NaT", nonexistent="NaT")
+    return (t - pd.Timestamp(0, tz="UTC")) / pd.Timedelta(seconds=1)
+
+
+def prepare(chunk, tz):
+    """A chunk of a file as a frame of COLUMNS with integer read_time and
+    reactor. Rows without a valid time or reactor are dropped."""
+    missing = {"read_time", "reactor"} - set(chunk.columns)
+    if missing:
+        raise ValueError(f"missing column(s): {', '.join(sorted(missing))}")
+    df = chunk.reindex(columns=COLUMNS)
+    df["read_time"] = unix_times(df["read_time"], tz)
+    for col in COLUMNS[1:-1]:
+        df[col] = pd.to_numeric(df[col], errors="coerce")
+    df = df[df["read_time"].notna() & df["reactor"].between(0, KEY_SPAN - 1)]
+    return df.astype({"read_time": "int64", "reactor": "int64"})
+
+
+def existing_keys(start, end):
+    """Keys of the rows logged between start and end, archived or not."""
+    keys = [np.empty(0, dtype=np.int64)]
+    for _, rows in archive.iter_chunks(start, end, columns=["read_time", "reactor"]):
+        if rows:
+            a = np.array(rows, dtype=np.int64)
+            keys.append(a[:, 0] * KEY_SPAN + a[:, 1])
+    return np.concatenate(keys)
+
+
+def import_file(path, sep=None, tz="UTC", chunk_size=CHUNK_SIZE):
+    """Insert the new rows of a file, in batches of BATCH_SIZE rows per
+    transaction. Returns (rows read, rows imported, first and last read_time
+    imported). Files sorted by time, such as exports, import fastest."""
+    if sep is None:
+        sep = "," if ".csv" in os.path.basename(path).lower() else "\t"
+    read = imported = 0
+    first, last = None, None
+    for chunk in pd.read_csv(
+        path, sep=sep, chunksize=chunk_size, dtype={"comment": str}, float_precision="round_trip"
+    ):
+        read += len(chunk)
+        df = prepare(chunk, tz)
+        if df.empty:
+            continue
+        keys = df["read_time"].to_numpy() * KEY_SPAN + df["reactor"].to_numpy()
+        new = ~pd.Series(keys).duplicated().to_numpy()
+        new &= ~np.isin(keys, existing_keys(int(df["read_time"].min()), int(df["read_time"].max())))
+        df = df[new]
+        if df.empty:
+            continue
+
+        df.insert(0, "id", None)
+        rows = df.astype(object).where(df.notna(), None).to_dict("records")
+        for i in range(0, len(rows), BATCH_SIZE):
+            db.bulk_insert(rows[i : i + BATCH_SIZE])
+        imported += len(rows)
+        first = min(first or 2**62, int(df["read_time"].min()))
+        last = max(last or 0, int(df["read_time"].max()))
+        print(f"{path}: {imported} of {read} rows imported.", file=sys.stderr)
+    return read, imported, first, last
+
+
+def rebuild_rrds():
+    """Recreate the RRDs of the reactors from the database, over their span."""
+    end = int(time.time())
+    start = end - rrd.RRD_SPAN
+    series = {}
+    for _, rows in archive.iter_chunks(start, end, columns=["reactor", "read_time", "vol", "h2", "co2"]):
+        for reactor, *row in rows:
+            series.setdefault(int(reactor), []).append(row)
+    for reactor, rows in sorted(series.items()):
+        rows.sort(key=lambda row: row[0])
+        rrd.rebuild(reactor, rows, start=start - 1)
+    return sorted(series)
+
+
+def main():
+    args = parser.parse_args()
+    db.init()
+    db.migrate()
+
+    started = time.perf_counter()
+    first, last, total = None, None, 0
+    for path in args.files:
+        try:
+            read, imported, file_first, file_last = import_file(path, args.sep, args.tz, args.chunk_size)
+        except (OSError, ValueError) as e:
+            print(f"{path}: cannot import: {e}", file=sys.stderr)
+            continue
+        print(f"{path}: imported {imported} new rows, skipped {read - imported}.", file=sys.stderr)
+        if imported:
+            total += imported
+            first = min(first or 2**62, file_first)
+            last = max(last or 0, file_last)
+    if not total:
+        return
+
+    print("Updating the yield index.", file=sys.stderr)
+    yields.rebuild_from(first)
+    if not args.no_rrd and last > time.time() - rrd.RRD_SPAN:
+        print(f"Rebuilt the RRDs of reactors {rebuild_rrds()}.", file=sys.stderr)
+    print(f"Imported {total} rows in {time.perf_counter() - started:.1f} s.", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
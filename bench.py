@@ -0,0 +1,251 @@
+# bench.py --
+#   benchmarks for the hot paths of the logger and the web app, run against
+#   seeded databases and fake devices. results are written as json, so runs
+#   on different releases can be compared.
+
+import os
+import sys
+import json
+import time
+import shutil
+import atexit
+import sqlite3
+import argparse
+import platform
+import tempfile
+import tracemalloc
+import subprocess
+from datetime import datetime
+
+# keep everything away from the real database and rrd files. this has to
+# happen before db, rrd and extract are imported. the seeded databases take
+# hundreds of MB, so they are removed afterwards unless --keep is given
+WORK_DIR = tempfile.mkdtemp(prefix="gasmix-bench-")
+atexit.register(shutil.rmtree, WORK_DIR, ignore_errors=True)
+os.environ["GASMIX_DB"] = os.path.join(WORK_DIR, "bench.db")
+os.environ["GASMIX_RRD_DIR"] = os.path.join(WORK_DIR, "rrd")
+os.environ["GASMIX_ARCHIVE_DIR"] = os.path.join(WORK_DIR, "archive")  # exports read it too
+os.environ["RRDCACHED_ADDRESS"] = ""
+
+import rrdtool
+from falcon import testing
+
+import db
+import rrd
+import extract
+from acquire import Acquisition
+from fake_sensors import FakeBlueVary, FakeBlueVCount
+
+# the retention of the old delete_oldest trigger
+MAX_ROWS = 4730400
+HOURS_PRESETS = [4, 8, 24, 48, 72, 168]
+EXTRACT_RANGES = {"1d": 1, "1m": 30, "1y": 365}
+
+parser = argparse.ArgumentParser()
+parser.add_argument(
+    "--sizes",
+    type=int,
+    nargs="+",
+    default=[100000, 1000000, MAX_ROWS],
+    help=f"Database sizes (rows) to benchmark (default: 100000 1000000 {MAX_ROWS})",
+)
+parser.add_argument("--cycles", type=int, default=200, help="Logger cycles to insert per size (default: 200)")
+parser.add_argument("--repeat", type=int, default=3, help="Repetitions of each timing, the best is reported (default: 3)")
+parser.add_argument("--bus-latency", type=float, default=0.02, help="Fake device transaction time in seconds (default: 0.02)")
+parser.add_argument("-o", "--output", default=None, help="Write results to this file (default: stdout)")
+parser.add_argument("--keep", action="store_true", help="Keep the seeded databases and RRDs afterwards")
+
+
+def best_of(repeat, func, *args, **kwargs):
+    """Returns the shortest wall time of `repeat` calls."""
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func(*args, **kwargs)
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+def row(read_time, reactor, sampled):
+    nan = float("nan")
+    return dict(
+        id=None,
+        read_time=read_time,
+        reactor=reactor,
+        vol=10.0 + reactor,
+        h2=70.0 if sampled else nan,
+        co2=30.0 if sampled else nan,
+        temp=21.0,
+        pressure=1.013,
+        humidity=1.0 if sampled else nan,
+        comment="",
+    )
+
+
+def seed(rows, end=None):
+    """Create a fresh database with `rows` rows of three-reactor minute data
+    ending at `end` (default: now)."""
+    if db.queries is not None:
+        db.queries.engine.dispose()
+    for suffix in ("", "-wal", "-shm"):
+        if os.path.exists(db.DB_FILE + suffix):
+            os.remove(db.DB_FILE + suffix)
+    db.init()
+    db.migrate()
+
+    end = int(end or time.time())
+    minutes = rows // 3
+    start = end - minutes * 60
+
+    def generate():
+        for m in range(minutes):
+            t = start + m * 60
+            sampled = (m // 60) % 3
+            for r in range(3):
+                yield tuple(row(t, r, r == sampled).values())
+
+    # plain sqlite3 is much faster than going through pugsql for millions of rows
+    conn = sqlite3.connect(db.DB_FILE)
+    with conn:
+        conn.executemany(
+            "INSERT INTO sensordata VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", generate()
+        )
+    conn.close()
+    for resolution in db.ROLLUP_RESOLUTIONS.values():
+        db.queries.backfill_rollup(resolution=resolution)
+    return start, end
+
+
+def bench_insert(size, cycles):
+    """Insert throughput of the old row-at-a-time path with the delete_oldest
+    trigger on, and of the current batched path."""
+    _, end = seed(size)
+    results = {"rows": size}
+
+    db.queries.create_trigger_delete_oldest()
+    start = time.perf_counter()
+    for c in range(cycles):
+        for r in range(3):
+            db.queries.insert_sensordata(**row(end + 60 * (c + 1), r, r == 0))
+    results["trigger_rows_per_s"] = 3 * cycles / (time.perf_counter() - start)
+    db.queries.drop_trigger_delete_oldest()
+
+    end += 60 * cycles
+    start = time.perf_counter()
+    for c in range(cycles):
+        db.insert_rows([row(end + 60 * (c + 1), r, r == 0) for r in range(3)])
+    results["batched_rows_per_s"] = 3 * cycles / (time.perf_counter() - start)
+    return results
+
+
+def bench_extract(client, end, repeat):
+    """Latency and peak (python) memory of TSV exports over several ranges."""
+    results = {}
+    fmt = "%Y-%m-%dT%H:%M"
+    for name, days in EXTRACT_RANGES.items():
+        params = {
+            "start_date": datetime.fromtimestamp(end - days * 86400).strftime(fmt),
+            "end_date": datetime.fromtimestamp(end).strftime(fmt),
+        }
+        seconds = best_of(repeat, client.simulate_get, "/extract/extract_tsv", params=params)
+
+        tracemalloc.start()
+        result = client.simulate_get("/extract/extract_tsv", params=params)
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        results[name] = {
+            "seconds": seconds,
+            "peak_bytes": peak,
+            "response_bytes": len(result.content),
+        }
+    return results
+
+
+def bench_graph(client, repeat):
+    """Render time of the rrd graphs, uncached and through the web app's cache."""
+    minutes = 7 * 24 * 60
+    start = int(time.time()) - minutes * 60
+    files = [rrd.rrd_file(i) for i in range(3)]
+    for f in files:
+        if os.path.exists(f):
+            os.remove(f)
+    rrd.create_rrds(files, start=start - 60)
+    for f in files:
+        updates = [f"{start + m * 60}:10:70:30" for m in range(minutes)]
+        for i in range(0, minutes, 1000):
+            rrdtool.update(f, *updates[i : i + 1000])
+
+    results = {}
+    for hours in HOURS_PRESETS:
+        params = {"reactor": 0, "hours": hours, "width": 400, "height": 600}
+        client.simulate_get("/extract/rrdgraph", params=params)  # fill the cache
+        results[str(hours)] = {
+            "render_seconds": best_of(
+                repeat, rrd.custom_rrd_graph, reactor=0, duration=hours, width=400, height=600
+            ),
+            "cached_seconds": best_of(repeat, client.simulate_get, "/extract/rrdgraph", params=params),
+        }
+    return results
+
+
+def bench_acquisition(latency, repeat):
+    """Time for reading all devices once, per cycle, with fake devices."""
+    bv = FakeBlueVary(latency=latency)
+    bcs = [FakeBlueVCount(10, latency=latency) for _ in range(3)]
+    acq = Acquisition([bv], [bcs])
+    try:
+        return {
+            "latency": latency,
+            "counters_seconds": best_of(repeat, acq.read_counters),
+            "gas_seconds": best_of(repeat, acq.read_gas),
+            "cycle_seconds": best_of(repeat, acq.read_all),
+        }
+    finally:
+        acq.close()
+
+
+def version():
+    try:
+        return subprocess.run(
+            ["git", "describe", "--always", "--dirty"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    args = parser.parse_args()
+    if args.keep:
+        atexit.unregister(shutil.rmtree)
+        print(f"Keeping the benchmark files in {WORK_DIR}", file=sys.stderr)
+    client = testing.TestClient(extract.app)
+
+    results = {
+        "version": version(),
+        "time": time.time(),
+        "machine": platform.machine(),
+        "python": platform.python_version(),
+        "sqlite": sqlite3.sqlite_version,
+        "acquisition": bench_acquisition(args.bus_latency, args.repeat),
+        "graph": bench_graph(client, args.repeat),
+        "insert": [],
+    }
+    for size in sorted(args.sizes):
+        print(f"Benchmarking {size} rows...", file=sys.stderr)
+        results["insert"].append(bench_insert(size, args.cycles))
+
+    # exports run on the largest database
+    _, end = seed(max(args.sizes))
+    results["extract"] = bench_extract(client, end, args.repeat)
+    results["extract"]["rows"] = max(args.sizes)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+    else:
+        json.dump(results, sys.stdout, indent=2)
+        print()
+
+
+if __name__ == "__main__":
+    main()
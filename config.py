@@ -0,0 +1,81 @@
+# config.py --
+#   device topology of the logger: the gas analysers, the rs485 buses with
+#   their gas counters, and the rocker valves. see misc/gasmix.example.json
+
+import os
+import json
+
+CONFIG_FILE = os.environ.get("GASMIX_CONFIG", os.path.expanduser("~/gasmix.json"))
+
+# serial settings of the bluevcounts. a bus without a device uses the -d
+# argument of main.py, or the first /dev/ttyUSB* entry
+BUS_DEFAULTS = {"device": None, "baudrate": 38400, "stopbits": 2}
+
+# the original setup: three reactors, one counter bus and one analyser
+DEFAULT = {
+    "analysers": [{"name": "bluevary", "host": "192.168.10.230"}],
+    "buses": [{"addresses": [1, 2, 3]}],
+    "rockers": [17, 18, 27],
+}
+
+
+class ConfigError(ValueError):
+    pass
+
+
+def load(path=None, num_reactors=None):
+    """Read and check the topology, or return the default one if there is no
+    config file. Reactors are numbered from 0 in the order of the counters,
+    bus by bus; rockers[i] is the gpio pin (bcm numbering) of reactor i.
+    Each analyser samples the reactors listed in its "reactors" (by default
+    all of them), which must not overlap between analysers.
+
+    If num_reactors is given, only the first num_reactors reactors are used."""
+    path = path or CONFIG_FILE
+    if os.path.exists(path):
+        with open(path) as f:
+            try:
+                config = json.load(f)
+            except json.JSONDecodeError as e:
+                raise ConfigError(f"{path}: {e}") from None
+    else:
+        config = DEFAULT
+
+    try:
+        buses = [dict(BUS_DEFAULTS, **bus) for bus in config["buses"]]
+        count = sum(len(bus["addresses"]) for bus in buses)
+        analysers = [dict(analyser) for analyser in config["analysers"]]
+        rockers = list(config["rockers"])
+    except (KeyError, TypeError) as e:
+        raise ConfigError(f"{path}: missing or malformed entry {e}") from None
+
+    if count == 0:
+        raise ConfigError(f"{path}: no counters configured")
+    if not analysers or any("host" not in analyser for analyser in analysers):
+        raise ConfigError(f"{path}: every analyser needs a host")
+    if len(rockers) != count:
+        raise ConfigError(f"{path}: {len(rockers)} rockers for {count} counters")
+    if sum(bus["device"] is None for bus in buses) > 1:
+        raise ConfigError(f"{path}: only one bus can use the default device")
+
+    sampled = []
+    for i, analyser in enumerate(analysers):
+        analyser.setdefault("name", "bluevary" if len(analysers) == 1 else f"bluevary{i + 1}")
+        analyser.setdefault("reactors", list(range(count)) if len(analysers) == 1 else [])
+        sampled += analyser["reactors"]
+    if len(sampled) != len(set(sampled)) or not set(sampled) <= set(range(count)):
+        raise ConfigError(f"{path}: analysers must sample distinct reactors 0-{count - 1}")
+
+    if num_reactors is not None:
+        if not 1 <= num_reactors <= count:
+            raise ConfigError(f"{path}: cannot track {num_reactors} of {count} reactors")
+        rockers = rockers[:num_reactors]
+        remaining = num_reactors
+        for bus in buses:
+            bus["addresses"] = bus["addresses"][:remaining]
+            remaining -= len(bus["addresses"])
+        buses = [bus for bus in buses if bus["addresses"]]
+        for analyser in analysers:
+            analyser["reactors"] = [r for r in analyser["reactors"] if r < num_reactors]
+
+    return dict(analysers=analysers, buses=buses, rockers=rockers, num_reactors=len(rockers))
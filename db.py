@@ -1,20 +1,244 @@
 import pugsql
+import sqlalchemy
+import metrics
+import queue
+import threading
 import time
 import sys
 import os
 
-DB_FILE = os.path.expanduser("~/gasferm.db")
+DB_FILE = os.environ.get("GASMIX_DB", os.path.expanduser("~/gasferm.db"))
+QUERY_DIR = "queries/"
+
+# rollup resolutions in seconds, see Database.md
+ROLLUP_RESOLUTIONS = {"10min": 600, "hour": 3600, "day": 86400}
+
+# rows older than this are removed by prune(), roughly matching the
+# three years kept by the old delete_oldest trigger
+RETENTION_DAYS = 3 * 365
 
 queries = None
 
 
+def set_pragmas(dbapi_conn, conn_record):
+    """Use WAL so the web app can read while the logger writes. With WAL,
+    synchronous=NORMAL is still safe against corruption and avoids an fsync
+    per commit on the SD card."""
+    cur = dbapi_conn.cursor()
+    cur.execute("PRAGMA journal_mode=WAL")
+    cur.execute("PRAGMA synchronous=NORMAL")
+    cur.execute("PRAGMA cache_size=-8000")  # 8 MB
+    cur.execute("PRAGMA busy_timeout=5000")
+    cur.close()
+
+
 def init():
     global queries
-    queries = pugsql.module("queries/")
-    queries.connect("sqlite:///" + DB_FILE)
+    queries = pugsql.module(QUERY_DIR)
+    engine = sqlalchemy.create_engine("sqlite:///" + DB_FILE)
+    sqlalchemy.event.listen(engine, "connect", set_pragmas)
+    queries.setengine(engine)
 
 
-def rebuild_db():
+def create_schema():
     print("Creating new database.", file=sys.stderr)
     queries.create_table_sensordata()
     queries.create_trigger_delete_oldest()
+
+
+def add_time_index():
+    """Index sensordata on time, and replace the per-insert delete trigger
+    with periodic pruning."""
+    queries.create_index_sensordata_time()
+    queries.drop_trigger_delete_oldest()
+
+
+def add_rollups():
+    """Create the rollup table and fill it from the existing data."""
+    queries.create_table_rollup()
+    for resolution in ROLLUP_RESOLUTIONS.values():
+        queries.backfill_rollup(resolution=resolution)
+
+
+def add_yield_index():
+    """Create the yield index table. It is filled by yields.update()."""
+    queries.create_table_yield_index()
+
+
+def add_replication():
+    """Create the tables for sending rows to a central node (replication) and
+    for receiving them from other sites (site, sitedata), see replicate.py."""
+    queries.create_table_replication()
+    queries.create_table_site()
+    queries.create_table_sitedata()
+    queries.create_index_sitedata_time()
+
+
+def add_yield_composition():
+    """Recreate the yield index with the composition of each row, which
+    bounds how much data yields.update() reads (see yields.py). It is
+    refilled by yields.update()."""
+    queries.drop_table_yield_index()
+    queries.create_table_yield_index()
+
+
+# migrations[i] upgrades the schema from version i to version i + 1
+MIGRATIONS = [
+    create_schema,
+    add_time_index,
+    add_rollups,
+    add_yield_index,
+    add_replication,
+    add_yield_composition,
+]
+
+
+def migrate():
+    """Create the database, or upgrade an existing one in place."""
+    queries.create_table_meta()
+    version = queries.get_schema_version()
+    if version is None:
+        # databases from before versioning was introduced are at version 1
+        version = 1 if queries.table_exists(name="sensordata") else 0
+
+    for version, migration in enumerate(MIGRATIONS[version:], version + 1):
+        print("Upgrading database to version", version, file=sys.stderr)
+        with queries.transaction():
+            migration()
+            queries.set_schema_version(created=time.time(), version=version)
+
+
+def prune(retention_days=RETENTION_DAYS, batch_size=10000):
+    """Delete rows older than the retention horizon, in small batches so the
+    database is never locked for long. Returns the number of deleted rows."""
+    cutoff = int(time.time() - retention_days * 86400)
+    total = 0
+    while True:
+        with queries.transaction():
+            deleted = queries.prune_sensordata(cutoff=cutoff, batch_size=batch_size)
+        total += deleted
+        if deleted < batch_size:
+            return total
+
+
+def read_sql(name):
+    with open(os.path.join(QUERY_DIR, name + ".sql")) as f:
+        return f.read()
+
+
+def iter_chunks(name, chunk_size=5000, **params):
+    """Run the query in queries/<name>.sql on a plain sqlite cursor and yield
+    (columns, rows) in chunks of at most chunk_size rows, so that large
+    results never have to be held in memory at once. Yields at least one
+    (possibly empty) chunk."""
+    sql = read_sql(name)
+
+    conn = queries.engine.raw_connection()
+    try:
+        cur = conn.cursor()
+        cur.execute(sql, params)
+        columns = [d[0] for d in cur.description]
+        rows = cur.fetchmany(chunk_size)
+        yield columns, rows
+        while rows := cur.fetchmany(chunk_size):
+            yield columns, rows
+    finally:
+        conn.close()
+
+
+def insert_rows(rows):
+    """Insert a list of sensordata rows (dicts) in a single transaction,
+    and add them to the rollups."""
+    start = time.perf_counter()
+    with queries.transaction():
+        queries.insert_sensordata(rows)
+        for resolution in ROLLUP_RESOLUTIONS.values():
+            queries.upsert_rollup([dict(row, resolution=resolution) for row in rows])
+        inserted = time.perf_counter()
+    metrics.observe("db_insert_seconds", inserted - start)
+    metrics.observe("db_commit_seconds", time.perf_counter() - inserted)
+
+
+def bulk_insert(rows):
+    """Like insert_rows, but for imports of many rows (see backfill.py): the
+    same statements run with executemany on a plain sqlite cursor, which
+    skips SQLAlchemy's per-row parameter processing."""
+    insert, upsert = read_sql("insert_sensordata"), read_sql("upsert_rollup")
+    start = time.perf_counter()
+    conn = queries.engine.raw_connection()
+    try:
+        cur = conn.cursor()
+        cur.executemany(insert, rows)
+        for resolution in ROLLUP_RESOLUTIONS.values():
+            cur.executemany(upsert, [dict(row, resolution=resolution) for row in rows])
+        conn.commit()
+    except BaseException:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+    metrics.observe("db_insert_seconds", time.perf_counter() - start)
+
+
+class Writer(threading.Thread):
+    """Writes rows to the database from a dedicated thread, so that a busy
+    database never delays sensor acquisition. The queue is bounded; if the
+    database stays blocked for long enough to fill it, new rows are dropped
+    (unless `block` is set, in which case submit() waits for room instead).
+
+    Old rows are pruned from the same thread every `prune_interval` seconds.
+    If `on_insert` is given, it is called with each list of rows after they
+    have been written (see yields.update); its errors are logged and
+    counted in on_insert_errors_total, and do not stop the writer."""
+
+    def __init__(
+        self,
+        maxsize=120,
+        retention_days=RETENTION_DAYS,
+        prune_interval=3600,
+        block=False,
+        on_insert=None,
+    ):
+        super().__init__(name="dbwriter", daemon=True)
+        self.queue = queue.Queue(maxsize)
+        self.block = block
+        self.on_insert = on_insert
+        self.retention_days = retention_days
+        self.prune_interval = prune_interval
+        self.last_prune = None
+
+    def submit(self, rows):
+        try:
+            self.queue.put(rows, block=self.block)
+        except queue.Full:
+            metrics.inc("db_dropped_rows_total", len(rows))
+            print("Database write queue full, dropping", len(rows), "rows.", file=sys.stderr)
+
+    def run(self):
+        while (rows := self.queue.get()) is not None:
+            try:
+                insert_rows(rows)
+            except sqlalchemy.exc.SQLAlchemyError as e:
+                metrics.inc("db_errors_total")
+                print("Database write failed:", e, file=sys.stderr)
+            else:
+                # the hook (e.g. the yield index) must never stop the writer
+                try:
+                    if self.on_insert is not None:
+                        self.on_insert(rows)
+                except Exception as e:
+                    metrics.inc("on_insert_errors_total")
+                    print("Updating after a database write failed:", repr(e), file=sys.stderr)
+            metrics.set_gauge("db_queue_length", self.queue.qsize())
+
+            if self.last_prune is None or time.monotonic() - self.last_prune > self.prune_interval:
+                self.last_prune = time.monotonic()
+                try:
+                    prune(self.retention_days)
+                except sqlalchemy.exc.SQLAlchemyError as e:
+                    print("Pruning old data failed:", e, file=sys.stderr)
+
+    def close(self):
+        """Write out any queued rows and stop the thread."""
+        self.queue.put(None)
+        self.join()
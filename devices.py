@@ -0,0 +1,133 @@
+# devices.py --
+#   bounded-latency access to the sensors: timeouts, reconnect backoff and
+#   circuit breakers, so that one failing device never holds up the others
+
+import sys
+import math
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
+
+import metrics
+from readings import CounterSnapshot, GasReading
+
+
+class Breaker:
+    """Circuit breaker for a device. After `threshold` consecutive failures
+    the breaker opens, and the device is left alone for a backoff period
+    that doubles (up to `max_backoff` seconds) every time a retry fails."""
+
+    def __init__(self, threshold=3, backoff=5, max_backoff=300, clock=time.monotonic):
+        self.threshold = threshold
+        self.base_backoff = self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.clock = clock
+        self.failures = 0
+        self.open_until = None
+
+    @property
+    def is_open(self):
+        return self.open_until is not None
+
+    def allow(self):
+        """Whether the device should be tried now."""
+        return self.open_until is None or self.clock() >= self.open_until
+
+    def success(self):
+        self.failures = 0
+        self.backoff = self.base_backoff
+        self.open_until = None
+
+    def failure(self, trip=False):
+        """Count a failure. If trip is set, open the breaker right away."""
+        self.failures += 1
+        if trip or self.failures >= self.threshold:
+            self.open_until = self.clock() + self.backoff
+            self.backoff = min(2 * self.backoff, self.max_backoff)
+
+
+class Guarded:
+    """Wraps a device. Reads return NaN at once while the device's breaker is
+    open. With a timeout, reads run on a worker thread of their own, and the
+    caller waits at most `timeout` seconds for them; a read that times out
+    opens the breaker immediately. Reconnecting happens as part of a read, so
+    it happens on the worker thread too, spaced out by the breaker's backoff.
+
+    Devices that share a bus with others must not use a timeout (a read that
+    is still running would collide with the next device's); bound their reads
+    with the bus timeout instead."""
+
+    def __init__(self, device, name, timeout=None, breaker=None, clock=None):
+        self.device = device
+        self.name = name
+        self.timeout = timeout
+        self.clock = clock or time
+        self.breaker = breaker or Breaker(clock=self.clock.monotonic)
+        self.executor = ThreadPoolExecutor(1, thread_name_prefix=name) if timeout else None
+        self.pending = None
+
+    def call(self, func, failed, fallback):
+        """Returns func(), or fallback() if the device is down, func() raised,
+        or failed(result)."""
+        if not self.breaker.allow():
+            return fallback()
+
+        was_open = self.breaker.is_open
+        try:
+            if self.executor is None:
+                result = func()
+            elif self.pending is not None and not self.pending.done():
+                # the last read is still hanging
+                result = None
+            else:
+                self.pending = self.executor.submit(func)
+                result = self.pending.result(timeout=self.timeout)
+        except TimeoutError:
+            result = None
+        except Exception as e:
+            # whatever the driver raises, a failing device must not stop the logger
+            print(f"{self.name} read failed: {e!r}", file=sys.stderr)
+            metrics.inc("device_errors_total", device=self.name)
+            result = None
+
+        if result is None or failed(result):
+            self.breaker.failure(trip=result is None)
+            if self.breaker.is_open and not was_open:
+                retry_in = self.breaker.open_until - self.clock.monotonic()
+                print(f"{self.name} is not responding, retrying in {retry_in:.0f} s.", file=sys.stderr)
+            self.report()
+            return fallback()
+
+        if was_open:
+            print(f"{self.name} is responding again.", file=sys.stderr)
+        self.breaker.success()
+        self.report()
+        return result
+
+    def report(self):
+        """Device health is reported as metrics, see metrics.py."""
+        metrics.set_gauge("device_up", int(not self.breaker.is_open), device=self.name)
+        metrics.set_gauge("device_failures", self.breaker.failures, device=self.name)
+
+    def close(self):
+        if self.executor is not None:
+            self.executor.shutdown(wait=False)
+
+
+class GuardedCounter(Guarded):
+    def read_snapshot(self):
+        return self.call(self.device.read_snapshot, lambda s: math.isnan(s.vol), self.nan_snapshot)
+
+    def nan_snapshot(self):
+        nan = float("nan")
+        return CounterSnapshot(self.clock.monotonic(), self.clock.time(), nan, nan, nan)
+
+
+class GuardedAnalyser(Guarded):
+    def read_gas(self):
+        return self.call(
+            self.device.read_gas, lambda g: math.isnan(g.h2) and math.isnan(g.co2), self.nan_gas
+        )
+
+    def nan_gas(self):
+        nan = float("nan")
+        return GasReading(self.clock.monotonic(), self.clock.time(), nan, nan, nan)
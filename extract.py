@@ -1,37 +1,62 @@
 # extract.py --
 #   falcon web app for presenting and exporting data from the gas mixer/logger
+#
+# gunicorn (re)starts workers often, so importing this module is kept cheap:
+# heavy modules (pandas, rrdtool, the database) are loaded by the routes that
+# need them, on first use, and the webcam is only opened when it is viewed.
+
+import time
+
+STARTED = time.perf_counter()
 
 import os
+import sys
+import hmac
+import zlib
+import atexit
 import shutil
+import importlib
+import threading
 from textwrap import dedent
-from datetime import datetime
+from collections import OrderedDict
+from datetime import datetime, timezone
+from zoneinfo import ZoneInfo
 
-import cv2
 import falcon
-import rrdtool
-import pandas as pd
 
-import db
-import rrd
+import webcam
+import metrics
 
 # define the local time zone
 LOCAL_TZ = "Europe/Stockholm"
 
+# each open webcam or live data stream holds one of the worker's threads for
+# as long as it is open. beyond this many, new streams are refused, so that
+# pages and api requests still get a thread (the web unit runs 8 threads)
+MAX_STREAMS = int(os.environ.get("GASMIX_MAX_STREAMS", 6))
+
+# shared secret that loggers must send to /api/replicate (see replicate.py).
+# without it, this node does not accept replicated rows
+REPLICATION_TOKEN = os.environ.get("GASMIX_REPLICATION_TOKEN")
+
+# largest (gzipped) batch accepted from a logger; a full batch is well
+# under a megabyte
+MAX_BATCH_BYTES = int(os.environ.get("GASMIX_MAX_BATCH_BYTES", 16 * 2**20))
+
 # web page for showing graphs
 INDEX_PAGE = dedent("""\
-    <meta http-equiv="refresh" content="60">
     <link rel="stylesheet" href="https://cdn.jsdelivr.net/npm/purecss@3.0.0/build/pure-min.css" integrity="sha384-X38yfunGUhNzHpBaEBsWLO+A0HDYOQi8ufWDkZ0k9e0eXz/tH3II7uKZ9msv++Ls" crossorigin="anonymous">
     <link rel="stylesheet" href="https://cdn.jsdelivr.net/npm/purecss@3.0.0/build/grids-responsive-min.css">
+    <link rel="stylesheet" href="https://cdn.jsdelivr.net/npm/uplot@1.6.30/dist/uPlot.min.css">
+    <script src="https://cdn.jsdelivr.net/npm/uplot@1.6.30/dist/uPlot.iife.min.js"></script>
     <meta name="viewport" content="width=device-width, initial-scale=1">
 
     <body>
         <div class="pure-g">
             <div class="pure-u-1">
                 <div style="display: flex;">
-                    <img src="{img}&reactor=0&width=400&height=600" class="pure-img" style="width: 56.25%; max-height: 95vh; object-fit: contain;" />
-                    <!-- <img src="{img}&reactor=1&width=400&height=600" class="pure-img" style="width: 33.33%;" />
-                    <img src="{img}&reactor=2&width=400&height=600" class="pure-img" style="width: 33.33%;" /> -->
-                    <img src="/webcam.jpg" class="pure-img" style="width: 43.75%; max-height: 95vh; object-fit: contain;" />
+                    <div id="chart" data-hours="{hours}" data-reactor="{reactor}" style="width: 56.25%; height: 95vh;"></div>
+                    <img src="/webcam.mjpg" class="pure-img" style="width: 43.75%; max-height: 95vh; object-fit: contain;" />
                 </div>
             </div>
             <!-- <div class="pure-u-1" style="display: flex; justify-content: center; align-items: center;">
@@ -45,16 +70,83 @@ INDEX_PAGE = dedent("""\
                     <a href="/?hours=48" class="pure-button">48 h</a>
                     <a href="/?hours=72" class="pure-button">72 h</a>
                     <a href="/?hours=168" class="pure-button">1 w</a>
+                    <a href="/extract/graph?hours=720&reactor={reactor}" class="pure-button">30 d</a>
+                    <a href="/extract/graph?hours=2160&reactor={reactor}" class="pure-button">90 d</a>
+                    <a href="/extract/graph?hours=8760&reactor={reactor}" class="pure-button">1 y</a>
                     <a href="extract" class="pure-button" style="background: rgb(210, 196, 240)">Export data to TSV</a>
                 </p>
             </div>
             <div class="pure-u-1" style="display: flex; justify-content: center; align-items: center;">
                 <hr>
-                <span style="font-family: Helvetica; color: #bbb;">Last reload: {today} -- Remaining disk space: {df} MB</span></p>
+                <span style="font-family: Helvetica; color: #bbb;">Last update: <span id="last">-</span> -- Remaining disk space: {df} MB</span></p>
             </div>
         </div>
+        <script>{script}</script>
     </body>""")
 
+# live chart for the index page. it loads the selected time range from the
+# data api once, then appends the samples pushed from /api/live
+CHART_SCRIPT = """
+    const el = document.getElementById('chart');
+    const hours = Number(el.dataset.hours);
+    const reactor = Number(el.dataset.reactor);
+    const query = `reactor=${reactor}&columns=vol,h2,co2`;
+    const data = [[], [], [], []];
+
+    const plot = new uPlot({
+        title: `Reactor ${reactor}`,
+        width: el.clientWidth,
+        height: el.clientHeight - 50,
+        scales: {y: {range: [-5, 75]}},
+        axes: [{}, {label: 'Flow [ml/min] / H2 [%] / CO2 [%]'}],
+        series: [
+            {},
+            {label: 'Flow', stroke: '#FF8439'},
+            {label: 'H2', stroke: '#2848FE', spanGaps: true},
+            {label: 'CO2', stroke: '#4B7B5B', spanGaps: true},
+        ],
+    }, data, el);
+    window.addEventListener('resize', () => plot.setSize({width: el.clientWidth, height: el.clientHeight - 50}));
+
+    let interim = false;  // whether the last point is a provisional one
+
+    function trim() {
+        // drop points that have scrolled out of the time range
+        const start = Date.now() / 1000 - hours * 3600;
+        const n = data[0].findIndex(t => t >= start);
+        data.forEach(a => a.splice(0, n < 0 ? a.length : n));
+        plot.setData(data);
+    }
+
+    function showLast(t) {
+        document.getElementById('last').textContent = new Date(t * 1000).toLocaleString();
+    }
+
+    async function load() {
+        const resp = await fetch(`/api/data?hours=${hours}&${query}`);
+        if (!resp.ok) return;
+        const json = await resp.json();
+        ['read_time', 'vol', 'h2', 'co2'].forEach((col, i) => data[i].push(...json.data[col]));
+        trim();
+        if (json.last !== null) showLast(json.last);
+
+        // from then on, samples are pushed by the logger as they are taken
+        const events = new EventSource(`/api/live?reactor=${reactor}`);
+        events.onmessage = (e) => {
+            const s = JSON.parse(e.data);
+            if (interim) data.forEach(a => a.pop());
+            interim = s.interim !== null;
+            // keep the points in time order
+            let i = data[0].length;
+            while (i > 0 && data[0][i - 1] > s.read_time) i--;
+            [s.read_time, s.vol, s.h2, s.co2].forEach((v, j) => data[j].splice(i, 0, v));
+            trim();
+            showLast(s.read_time);
+        };
+    }
+    load();
+"""
+
 EXTRACT_PAGE = dedent("""
     <link rel="stylesheet" href="https://cdn.jsdelivr.net/npm/purecss@3.0.0/build/pure-min.css" integrity="sha384-X38yfunGUhNzHpBaEBsWLO+A0HDYOQi8ufWDkZ0k9e0eXz/tH3II7uKZ9msv++Ls" crossorigin="anonymous">
     <link rel="stylesheet" href="https://cdn.jsdelivr.net/npm/purecss@3.0.0/build/grids-responsive-min.css">
@@ -96,6 +188,22 @@ EXTRACT_PAGE = dedent("""
                 <div class="pure-control-group">
                     <label for="end_date">End Date</label><input type="datetime-local" name="end_date" id="end_date">
                 </div>
+                <div class="pure-control-group">
+                    <label for="resolution">Resolution</label>
+                    <select name="resolution" id="resolution">
+                        <option value="minute">1 minute (raw data)</option>
+                        <option value="10min">10 minutes</option>
+                        <option value="hour">1 hour</option>
+                        <option value="day">1 day</option>
+                    </select>
+                </div>
+                <div class="pure-control-group">
+                    <label for="site">Site</label><input type="text" name="site" id="site" placeholder="this logger">
+                    <span class="pure-form-message-inline">On a central node: a site, several (a,b) or "all"</span>
+                </div>
+                <div class="pure-controls">
+                    <label for="gzip" class="pure-checkbox"><input type="checkbox" name="gzip" id="gzip" value="true"> Compress (gzip)</label>
+                </div>
                 <div class="pure-controls">
                     <button type="submit" class="pure-button pure-button-primary">Extract data</button>
                 </div>
@@ -108,25 +216,105 @@ EXTRACT_PAGE = dedent("""
     </html>
     """)
 
-db.init()
+_db_lock = threading.Lock()
+_import_lock = threading.Lock()
+
+
+def load(module):
+    """Import a module on first use, and record how long that took. The
+    module is always returned through importlib, which waits while another
+    thread is still importing it, rather than from sys.modules, where it
+    appears before it is fully initialised."""
+    with _import_lock:
+        if module not in sys.modules:
+            start = time.perf_counter()
+            importlib.import_module(module)
+            metrics.set_gauge("import_seconds", time.perf_counter() - start, module=module)
+    return importlib.import_module(module)
+
+
+def database():
+    """The db module, connected on first use in this process."""
+    db = load("db")
+    with _db_lock:
+        if db.queries is None:
+            db.init()
+            atexit.register(db.queries.engine.dispose)
+    return db
+
+
+class GraphCache:
+    """Size-bounded LRU cache of rendered graphs. Each entry is stored with a
+    version (e.g. the time of the last RRD update) and is only returned
+    while that version is current."""
+
+    def __init__(self, maxsize=64):
+        self.maxsize = maxsize
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key, version):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None or entry[0] != version:
+                return None
+            self.entries.move_to_end(key)
+            return entry[1]
+
+    def put(self, key, version, value):
+        with self.lock:
+            self.entries[key] = (version, value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+
+
+graph_cache = GraphCache()
+
+_streams = threading.BoundedSemaphore(MAX_STREAMS)
+
+
+class StreamSlot:
+    """A response stream that holds one of MAX_STREAMS slots until the server
+    closes it, which it does when the client disconnects."""
+
+    def __init__(self, stream):
+        if not _streams.acquire(blocking=False):
+            stream.close()
+            raise falcon.HTTPServiceUnavailable(
+                description="Too many open streams, try again later.", retry_after=30
+            )
+        self.stream = stream
+        self.released = False
+
+    def __iter__(self):
+        return iter(self.stream)
+
+    def close(self):
+        if not self.released:
+            self.released = True
+            self.stream.close()
+            _streams.release()
+
+
+def not_modified(req, etag, last_modified):
+    """Check the request's conditional headers against a resource version."""
+    if req.if_none_match is not None:
+        return "*" in req.if_none_match or etag in req.if_none_match
+    return req.if_modified_since is not None and req.if_modified_since >= last_modified
 
 
 class IndexPageResource:
     def on_get(self, req, resp):
         hours = req.get_param_as_int("hours", default=None)
-        if hours is None or hours < 0:
-            page_content = INDEX_PAGE.format(
-                img="/extract/rrdgraph?hours=4",
-                df=int(shutil.disk_usage(os.path.expanduser("~")).free / 1024**2),
-                today=datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
-            )
-        else:
-            # If the parameter is not supplied, display a default message
-            page_content = INDEX_PAGE.format(
-                img="/extract/rrdgraph?hours=" + str(hours),
-                df=int(shutil.disk_usage(os.path.expanduser("~")).free / 1024**2),
-                today=datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
-            )
+        if hours is None or hours <= 0:
+            hours = 4
+        page_content = INDEX_PAGE.format(
+            hours=hours,
+            reactor=req.get_param_as_int("reactor") or 0,
+            df=int(shutil.disk_usage(os.path.expanduser("~")).free / 1024**2),
+            script=CHART_SCRIPT,
+        )
 
         resp.content_type = "text/html"
         resp.status = falcon.HTTP_200
@@ -140,6 +328,31 @@ class DataResource:
         resp.text = EXTRACT_PAGE
 
 
+def tsv_chunks(chunks):
+    """Format chunks of sensordata rows as TSV, one chunk at a time."""
+    pd = load("pandas")
+    header = True
+    for columns, rows in chunks:
+        df = pd.DataFrame.from_records(rows, columns=columns)
+
+        # convert the 'read_time' column to a human-readable date and time, in
+        # UTC (localizing without converting never changed the output, and
+        # failed on ranges spanning a daylight saving time change)
+        df["read_time"] = pd.to_datetime(df["read_time"], unit="s").dt.strftime("%Y-%m-%d %H:%M:%S")
+
+        yield df.to_csv(index=False, sep="\t", header=header).encode()
+        header = False
+
+
+def gzip_chunks(chunks):
+    """Compress a stream of bytes on the fly."""
+    compressor = zlib.compressobj(wbits=31)  # gzip container
+    for chunk in chunks:
+        if data := compressor.compress(chunk):
+            yield data
+    yield compressor.flush()
+
+
 class ExtractDataResource:
     def on_get(self, req, resp):
         start_date = req.get_param("start_date")
@@ -151,73 +364,308 @@ class ExtractDataResource:
         )
         end_timestamp = int(datetime.strptime(end_date, "%Y-%m-%dT%H:%M").timestamp())
 
-        # Retrieve data from the database based on the date range
-        data = db.queries.extract_data(
-            start_timestamp=start_timestamp, end_timestamp=end_timestamp
-        )
-        df = pd.DataFrame(data)
-
-        # convert the 'read_time' column to datetime, localize it to the desired timezone, and format as human-readable
-        df["read_time"] = (
-            pd.to_datetime(df["read_time"], unit="s")
-            .dt.tz_localize(LOCAL_TZ)
-            .dt.strftime("%Y-%m-%d %H:%M:%S")
-        )
+        # Stream data from the database based on the date range, either raw
+        # (including any archived months) or from one of the rollups. On a
+        # central node, raw data can also come from other sites
+        db = database()
+        archive = load("archive")
+        resolution = req.get_param("resolution", default="minute")
+        # a form submitted with an empty site field sends site=
+        sites = req.get_param_as_list("site", delimiter=",") or []
+        sites = [site.strip() for site in sites if site.strip()] or None
+        if sites:
+            if resolution != "minute":
+                raise falcon.HTTPBadRequest(description="Data from other sites is only available at 1 minute resolution")
+            chunks = load("replicate").iter_chunks(
+                None if sites == ["all"] else sites, start_timestamp, end_timestamp
+            )
+        elif resolution == "minute":
+            chunks = archive.iter_chunks(start_timestamp, end_timestamp)
+        elif resolution in db.ROLLUP_RESOLUTIONS:
+            chunks = db.iter_chunks(
+                "extract_rollup",
+                resolution=db.ROLLUP_RESOLUTIONS[resolution],
+                start_timestamp=start_timestamp,
+                end_timestamp=end_timestamp,
+            )
+        else:
+            raise falcon.HTTPBadRequest(description=f"Unknown resolution: {resolution}")
+        stream = tsv_chunks(chunks)
 
-        resp.content_type = "text/tab-separated-values"
         resp.status = falcon.HTTP_200
-        resp.body = df.to_csv(index=False, sep="\t")
+        if req.get_param_as_bool("gzip"):
+            resp.content_type = "application/gzip"
+            resp.downloadable_as = "sensordata.tsv.gz"
+            resp.stream = gzip_chunks(stream)
+        else:
+            resp.content_type = "text/tab-separated-values"
+            resp.stream = stream
+
+
+class DataAPIResource:
+    """Raw sensordata as columnar JSON: {"data": {column: [values]}, "last":
+    read_time of the last row}. The range is given either as start/end (Unix
+    times; by default the last `hours` hours), or as since=<read_time> to get
+    only the rows added after an earlier response's "last". Rows can be
+    filtered by reactor (e.g. reactor=0,2) and columns (e.g. columns=vol,h2);
+    read_time and reactor are always included."""
+
+    def on_get(self, req, resp):
+        database()
+        archive = load("archive")
+        end = req.get_param_as_int("end") or int(time.time())
+        since = req.get_param_as_int("since")
+        if since is not None:
+            start = since + 1
+        else:
+            hours = req.get_param_as_int("hours", min_value=1, default=4)
+            start = req.get_param_as_int("start", default=end - hours * 3600)
+
+        reactors = req.get_param_as_list("reactor", transform=int, delimiter=",")
+        columns = req.get_param_as_list("columns", delimiter=",") or [
+            col for col in archive.COLUMNS if col != "id"
+        ]
+        unknown = set(columns) - set(archive.COLUMNS)
+        if unknown:
+            raise falcon.HTTPBadRequest(description=f"Unknown columns: {', '.join(sorted(unknown))}")
+        columns = ["read_time", "reactor"] + [c for c in columns if c not in ("read_time", "reactor")]
+
+        data = {col: [] for col in columns}
+        for _, rows in archive.iter_chunks(start, end, columns=columns):
+            for row in rows:
+                if reactors and row[1] not in reactors:
+                    continue
+                for col, value in zip(columns, row):
+                    # json has no NaN
+                    data[col].append(None if value != value else value)
+
+        resp.cache_control = ["no-store"]
+        resp.media = {
+            "data": data,
+            "last": max(data["read_time"], default=since),
+        }
+
+
+class YieldResource:
+    """Gas, H2 and CO2 (ml) produced per reactor between start and end (Unix
+    times, by default the last 24 hours), from the yield index (see
+    yields.py)."""
+
+    def on_get(self, req, resp):
+        db = database()
+        yields = load("yields")
+        end = req.get_param_as_int("end") or int(time.time())
+        start = req.get_param_as_int("start", default=end - 86400)
+        reactors = req.get_param_as_list("reactor", transform=int, delimiter=",") or [
+            int(r["reactor"])
+            for r in db.queries.get_reactors(resolution=db.ROLLUP_RESOLUTIONS["day"])
+        ]
+
+        result = {}
+        for reactor in reactors:
+            total = yields.total(reactor, start, end)
+            # json has no NaN; composition is unknown before a reactor's first measurement
+            result[reactor] = {k: None if v != v else v for k, v in total.items()}
+        resp.cache_control = ["no-cache"]
+        resp.media = {"start": start, "end": end, "reactors": result}
+
+
+class ReplicationResource:
+    """Receives batches of rows from other sites' loggers, see replicate.py."""
+
+    def on_post(self, req, resp):
+        if not REPLICATION_TOKEN:
+            raise falcon.HTTPForbidden(description="This node does not accept replicated rows")
+        token = (req.auth or "").removeprefix("Bearer ")
+        if not hmac.compare_digest(token.encode(), REPLICATION_TOKEN.encode()):
+            raise falcon.HTTPUnauthorized(description="Invalid replication token", challenges=["Bearer"])
+        if req.content_length is None:
+            raise falcon.HTTPLengthRequired()
+        if req.content_length > MAX_BATCH_BYTES:
+            raise falcon.HTTPContentTooLarge(description=f"Batches are limited to {MAX_BATCH_BYTES} bytes")
+
+        database()
+        replicate = load("replicate")
+        try:
+            last_id = replicate.receive(req.get_param("site"), req.bounded_stream.read())
+        except replicate.ReplicationError as e:
+            raise falcon.HTTPConflict(description=str(e))
+        except (OSError, EOFError, zlib.error, ValueError, KeyError) as e:
+            raise falcon.HTTPBadRequest(description=f"Invalid batch: {e}")
+        resp.media = {"last_id": last_id}
+
+
+class LiveResource:
+    """New samples as they are published by the logger, as server-sent
+    events. Browsers reconnect with Last-Event-ID and get the samples they
+    missed, as long as these are still in the ring buffer."""
+
+    def on_get(self, req, resp):
+        last_id = req.get_header("Last-Event-ID")
+        resp.content_type = "text/event-stream"
+        resp.cache_control = ["no-cache"]
+        resp.stream = StreamSlot(
+            load("live").event_stream(
+                last_id=int(last_id) if last_id and last_id.isdigit() else None,
+                reactors=req.get_param_as_list("reactor", transform=int, delimiter=","),
+            )
+        )
 
 
 class RRDGraphResource:
     def on_get(self, req, resp):
-        # make variables from the request parameters to save some space
-        req_vars = ["reactor", "hours", "width", "height"]
-        for var in req_vars:
-            globals()[var] = req.get_param_as_int(var)
+        reactor = req.get_param_as_int("reactor") or 0
+        hours = req.get_param_as_int("hours")
+        if hours is None or hours <= 0:
+            hours = 4
+        width = req.get_param_as_int("width") or 600
+        height = req.get_param_as_int("height") or 400
+        key = (reactor, hours, width, height)
+        rrd = load("rrd")
+        rrdtool = load("rrdtool")
 
         try:
-            # Generate the graph and capture it as a binary image
-            graph_binary = rrd.custom_rrd_graph(
-                reactor=reactor if reactor else 0,  # type: ignore
-                duration=hours if hours is not None and hours > 0 else 4,  # type: ignore
-                width=width if width else 600,  # type: ignore
-                height=height if height else 400,
-            )  # type: ignore
+            # graphs only change when the rrd is updated, i.e. once per minute
+            last = rrd.last_update(reactor)
+            graph = graph_cache.get(key, last)
+            if graph is None:
+                # Generate the graph and capture it as a binary image
+                graph = rrd.custom_rrd_graph(
+                    reactor=reactor, duration=hours, width=width, height=height
+                )["image"]
+                graph_cache.put(key, last, graph)
 
         except rrdtool.OperationalError as e:
             resp.status = falcon.HTTP_500  # Internal Server Error
             resp.text = f"Error generating RRDtool graph: {str(e)}"
             return
 
+        etag = "-".join(str(x) for x in (*key, last))
+        last_modified = datetime.fromtimestamp(last, timezone.utc)
+        resp.etag = etag
+        resp.last_modified = last_modified
+        resp.cache_control = ["no-cache"]  # always revalidate
+        if not_modified(req, etag, last_modified):
+            resp.status = falcon.HTTP_304
+            return
+
         # Set the response content type to display the image
         resp.content_type = "image/png"
-        resp.data = graph_binary["image"]
+        resp.data = graph
+
+
+class GraphResource:
+    """A reactor's flow, H2 and CO2 over any range as SVG, drawn from the
+    database rather than the RRDs (see graph.py). The range is given as
+    start/end (Unix times), or as the last `hours` hours (default: 30 days)."""
+
+    def on_get(self, req, resp):
+        db = database()
+        graph = load("graph")
+        reactor = req.get_param_as_int("reactor") or 0
+        width = req.get_param_as_int("width", min_value=200, max_value=4000) or 1200
+        height = req.get_param_as_int("height", min_value=150, max_value=2000) or 600
+        last = db.queries.get_last_read_time() or 0
+
+        end = req.get_param_as_int("end")
+        if end is None:
+            # a relative range moves with the data, like the rrd graphs
+            hours = req.get_param_as_int("hours", min_value=1, max_value=50 * 8760, default=720)
+            end = int(time.time())
+            start = end - hours * 3600
+            key, version = ("graph", hours, reactor, width, height), last
+        else:
+            start = req.get_param_as_int("start", required=True)
+            if start >= end:
+                raise falcon.HTTPBadRequest(description="start must be before end")
+            if start < graph.MIN_TIME or end > graph.MAX_TIME:
+                raise falcon.HTTPBadRequest(
+                    description=f"start and end must be between {graph.MIN_TIME} and {graph.MAX_TIME}"
+                )
+            # a fixed range only changes until its end has been logged
+            key, version = ("graph", start, end, reactor, width, height), min(last, end)
+
+        etag = "-".join(str(x) for x in (*key, version))
+        last_modified = datetime.fromtimestamp(version, timezone.utc)
+        resp.etag = etag
+        resp.last_modified = last_modified
+        resp.cache_control = ["no-cache"]  # always revalidate
+        if not_modified(req, etag, last_modified):
+            resp.status = falcon.HTTP_304
+            return
+
+        svg = graph_cache.get(key, version)
+        if svg is None:
+            svg = graph.render(reactor, start, end, width, height, tz=ZoneInfo(LOCAL_TZ)).encode()
+            graph_cache.put(key, version, svg)
+        resp.content_type = "image/svg+xml"
+        resp.data = svg
 
 
 class ImageResource:
     def on_get(self, req, resp):
-        ret, frame = cap.read()
-        #cap.release()
-        
-        # rotate the image before returning it
-        rot_frame = cv2.rotate(frame, cv2.ROTATE_90_CLOCKWISE)
-        _, img_encoded = cv2.imencode('.jpg', rot_frame)
-        resp.content_type = 'image/jpeg'
-        resp.body = img_encoded.tobytes()
+        webcam.start()
+        _, frame = webcam.latest_frame()
+        if frame is None:
+            raise falcon.HTTPServiceUnavailable(description="No webcam frame available yet.")
+        resp.content_type = "image/jpeg"
+        resp.data = frame
+
+
+class MJPEGResource:
+    def on_get(self, req, resp):
+        webcam.start()
+        resp.content_type = "multipart/x-mixed-replace; boundary=frame"
+        resp.cache_control = ["no-cache"]
+        resp.stream = StreamSlot(webcam.mjpeg_stream())
+
+
+class MetricsResource:
+    def on_get(self, req, resp):
+        text = metrics.render(metrics.snapshot())
+        logger = metrics.load()  # published by the logger, see main.py
+        if logger is not None:
+            text += metrics.render(logger)
+        resp.content_type = "text/plain; version=0.0.4"
+        resp.text = text
+
+
+class TimingMiddleware:
+    """Records the latency of each request by route. For streamed responses,
+    this is the time until the response starts."""
+
+    def process_request(self, req, resp):
+        req.context.start = time.perf_counter()
+
+    def process_response(self, req, resp, resource, req_succeeded):
+        metrics.observe(
+            "http_request_seconds",
+            time.perf_counter() - req.context.start,
+            route=req.uri_template or "unknown",
+            method=req.method,
+        )
+
 
 # create a falcon api instance
-app = falcon.App()
+app = falcon.App(middleware=[TimingMiddleware()])
 app.add_route('/', IndexPageResource())
 app.add_route('/extract', DataResource())                       # url for the tsv extractor
 app.add_route('/extract/extract_tsv', ExtractDataResource())    # url for the cgi endpoint (sqlite->tsv)
 app.add_route('/extract/rrdgraph', RRDGraphResource())          # url for the dynamically generated graph
+app.add_route('/extract/graph', GraphResource())                # graphs of any range, from the database
 app.add_route('/webcam.jpg', ImageResource())
-
-# capture device for webcam
-cap = cv2.VideoCapture(0)
-cap.set(cv2.CAP_PROP_FRAME_WIDTH, 1280)
-cap.set(cv2.CAP_PROP_FRAME_HEIGHT, 720)
+app.add_route('/webcam.mjpg', MJPEGResource())                  # live webcam stream
+app.add_route('/metrics', MetricsResource())                    # prometheus metrics
+app.add_route('/api/data', DataAPIResource())                   # sensordata as json
+app.add_route('/api/yield', YieldResource())                    # gas production over a time window
+app.add_route('/api/live', LiveResource())                      # live samples as server-sent events
+app.add_route('/api/replicate', ReplicationResource())          # rows from other sites' loggers
+
+# stop the webcam capture (if this process owns it) when the worker exits
+atexit.register(webcam.stop)
+
+metrics.set_gauge("startup_seconds", time.perf_counter() - STARTED)
+print(f"Web app loaded in {time.perf_counter() - STARTED:.3f} s (pid {os.getpid()}).", file=sys.stderr)
 
 # allow running from command line
 if __name__ == "__main__":
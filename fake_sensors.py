@@ -1,22 +1,90 @@
+import math
+import time
 import random
 import threading
 
+from readings import CounterSnapshot, GasReading
+
+# volume registered per counter tick (ml)
+QUANTUM = 0.6
+
+
+class RealClock:
+    """Wall-clock time, for running the fakes in real time."""
+
+    monotonic = staticmethod(time.monotonic)
+    sleep = staticmethod(time.sleep)
+    time = staticmethod(time.time)
+
+
+class VirtualClock:
+    """A clock that only advances when something sleeps on it, so that
+    simulated days pass in seconds."""
+
+    def __init__(self, start=None):
+        self.epoch = time.time() if start is None else start
+        self.now = 0.0
+        self.lock = threading.Lock()
+
+    def monotonic(self):
+        return self.now
+
+    def time(self):
+        return self.epoch + self.now
+
+    def sleep(self, seconds):
+        with self.lock:
+            self.now += max(seconds, 0)
+
+
+class FakeDevice:
+    """Bus latency (seconds per transaction) and the probability that a
+    transaction fails and returns NaN."""
+
+    def __init__(self, clock=None, latency=0, dropout=0):
+        self.clock = clock or RealClock()
+        self.latency = latency
+        self.dropout = dropout
+
+    def transaction(self):
+        """Returns False if the transaction failed."""
+        if self.latency:
+            self.clock.sleep(self.latency)
+        return random.random() >= self.dropout
+
+
+class FakeBlueVCount(FakeDevice):
+    """Registers a 0.6 ml tick at intervals given by the current flow rate,
+    which is redrawn around the base flow rate after every tick. The base flow
+    rate is constant, or given by profile(seconds since start)."""
 
-class FakeBlueVCount:
-    _vol = 0
-    timer = None
     flowrate = 10
     current_flowrate = 10
     flowvar = 0.5  # standard deviation on flow rate
-    delay = None
-    quitting = False
-    timer = None
 
-    def __init__(self, flowrate=10, flowvar=0.5):
-        self.delay = 60 / (flowrate / 0.6)
+    def __init__(self, flowrate=10, flowvar=0.5, profile=None, **kwargs):
+        super().__init__(**kwargs)
+        self._vol = 0
         self.flowvar = flowvar
         self.flowrate = self.current_flowrate = flowrate
-        self.set_new_timer()
+        self.profile = profile
+        self.start = self.clock.monotonic()
+        self.tick_pending = flowrate > 0
+        self.next_tick = self.start + (60 / (flowrate / QUANTUM) if flowrate > 0 else 60)
+
+    def advance(self):
+        """Add the ticks that have happened since the last read."""
+        now = self.clock.monotonic()
+        while self.next_tick <= now:
+            if self.tick_pending:
+                self._vol += QUANTUM
+            base = self.profile(self.next_tick - self.start) if self.profile else self.flowrate
+            self.current_flowrate = random.normalvariate(base, self.flowvar)
+            self.tick_pending = self.current_flowrate > 0
+            if self.tick_pending:
+                self.next_tick += 60 / (self.current_flowrate / QUANTUM)
+            else:
+                self.next_tick += 60  # no flow, check again in a minute
 
     def get_temp(self):
         return round(20.5 + random.random(), 1)
@@ -25,35 +93,81 @@ class FakeBlueVCount:
         return round(1.013 + random.uniform(-0.06, 0.06), 3)
 
     def get_vol(self):
+        self.advance()
         return round(self._vol, 1)
 
-    def set_new_timer(self):
-        if self.timer is not None:
-            self.timer.cancel()
-        if not self.quitting:
-            self.timer = threading.Timer(
-                60 / (self.current_flowrate / 0.6), self.add_vol
-            )
-            self.timer.start()
+    def read_snapshot(self):
+        if not self.transaction():
+            nan = float("nan")
+            return CounterSnapshot(self.clock.monotonic(), self.clock.time(), nan, nan, nan)
+        return CounterSnapshot(
+            self.clock.monotonic(),
+            self.clock.time(),
+            self.get_vol(),
+            self.get_pressure(),
+            self.get_temp(),
+        )
 
-    def add_vol(self):
-        self._vol += 0.6
-        self.current_flowrate = random.normalvariate(self.flowrate, self.flowvar)
-        self.set_new_timer()
 
+class FakeBlueVary(FakeDevice):
+    """After switch(), the H2 level approaches the new value exponentially
+    with the given response time (seconds), like gas being flushed out of
+    the lines and the sensor cell."""
 
-class FakeBlueVary:
     h2 = 70
     humidity = 1.0
 
-    def __init__(self, h2=70):
+    def __init__(self, h2=70, response_time=0, noise=3, **kwargs):
+        super().__init__(**kwargs)
+        self.h2 = self.prev_h2 = h2
+        self.response_time = response_time
+        self.noise = noise
+        self.switch_time = self.clock.monotonic()
+
+    def switch(self, h2):
+        self.prev_h2 = self.current_h2()
         self.h2 = h2
+        self.switch_time = self.clock.monotonic()
+
+    def current_h2(self):
+        if not self.response_time:
+            return self.h2
+        decay = math.exp(-(self.clock.monotonic() - self.switch_time) / self.response_time)
+        return self.h2 + (self.prev_h2 - self.h2) * decay
 
     def get_h2(self):
-        return random.gauss(self.h2, 3)
+        return random.gauss(self.current_h2(), self.noise)
 
     def get_co2(self):
-        return random.gauss(100 - self.h2, 3)
+        return random.gauss(100 - self.current_h2(), self.noise)
 
     def get_humidity(self):
         return random.gauss(self.humidity, 0.1)
+
+    def read_gas(self):
+        vals = [
+            read() if self.transaction() else float("nan")
+            for read in (self.get_h2, self.get_co2, self.get_humidity)
+        ]
+        return GasReading(self.clock.monotonic(), self.clock.time(), *vals)
+
+
+class FakeRockers:
+    """Stands in for gas_switch. Switching to a reactor sets the H2 level of
+    the reactor's analyser to that reactor's. analysers[i] is the analyser
+    of reactor i."""
+
+    def __init__(self, analysers, h2_levels, clock=None):
+        self.analysers = analysers
+        self.h2_levels = h2_levels
+        self.clock = clock or RealClock()
+        self.active = set()
+
+    def activate_rocker(self, num):
+        self.clock.sleep(0.5)
+        self.active = {r for r in self.active if self.analysers[r] is not self.analysers[num]}
+        self.active.add(num)
+        self.analysers[num].switch(self.h2_levels[num])
+
+    def cleanup(self):
+        self.active = set()
@@ -2,25 +2,37 @@ import sys
 import time
 import RPi.GPIO as GPIO
 
-# gpio pins of rockers - these correspond to reactors 1-3
+# gpio pins of rockers - rockers[i] corresponds to reactor i. the defaults are
+# those of the original three reactors, see setup() and config.py
 rockers = [17, 18, 27]
 
+# reactors sharing an analyser; only one rocker per group is open at a time
+groups = [list(range(len(rockers)))]
+
 # initialize gpio
 GPIO.setmode(GPIO.BCM)
-GPIO.setup(rockers, GPIO.OUT, initial=GPIO.LOW)
+
+
+def setup(pins, channels=None):
+    """Use the given rocker pins, one per reactor. channels lists the
+    reactors of each analyser (default: a single analyser for all)."""
+    global rockers, groups
+    rockers = list(pins)
+    groups = [list(c) for c in channels] if channels else [list(range(len(rockers)))]
+    GPIO.setup(rockers, GPIO.OUT, initial=GPIO.LOW)
 
 
 def activate_rocker(num):
-    """Activates the indicated rocker and deactivates the others."""
-    if not num in range(len(rockers)):
+    """Activates the indicated rocker and deactivates the others of its analyser."""
+    group = next((g for g in groups if num in g), None)
+    if not num in range(len(rockers)) or group is None:
         print("Invalid rocker number", num, file=sys.stderr)
         return
 
-    output = [GPIO.LOW] * 3
-    output[num] = GPIO.HIGH
-    GPIO.output(rockers, GPIO.LOW)
+    pins = [rockers[i] for i in group]
+    GPIO.output(pins, GPIO.LOW)
     time.sleep(0.5)
-    GPIO.output(rockers, output)
+    GPIO.output(rockers[num], GPIO.HIGH)
 
 
 def cleanup():
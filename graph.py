@@ -0,0 +1,197 @@
+# graph.py --
+#   graphs of a reactor's flow, h2 and co2 over any time range, e.g. a whole
+#   fermentation run, which the rrds (one week) cannot show. drawn as svg from
+#   sensordata or its rollups, downsampled to the width of the graph with
+#   largest-triangle-three-buckets (lttb)
+
+import math
+from html import escape
+from datetime import datetime, timezone
+
+import numpy as np
+
+import db
+import archive
+
+# at most this many rows per reactor are read for a graph: longer ranges are
+# drawn from the finest rollup that fits, so a graph takes about the same
+# time and memory whatever its range
+MAX_ROWS = 50000
+
+# seconds; longer gaps in a series (or two rollup buckets) are left open
+MAX_GAP = 3600
+
+COLUMNS = ["read_time", "vol", "h2", "co2"]
+
+# column, legend, colour (as in the rrd graphs)
+SERIES = [
+    ("vol", "Flow (ml/min)", "#FF8439"),
+    ("h2", "H2 (%)", "#2848FE"),
+    ("co2", "CO2 (%)", "#4B7B5B"),
+]
+
+SOURCE_NAMES = {60: "raw data", 600: "10 minute means", 3600: "hourly means", 86400: "daily means"}
+
+# candidate spacings of the time axis ticks, in seconds. longer spans get
+# round numbers of years
+TIME_STEPS = [600, 1800, 3600, 3 * 3600, 6 * 3600, 12 * 3600, 86400, 2 * 86400, 7 * 86400, 14 * 86400, 28 * 86400]
+TIME_STEPS += [91 * 86400, 182 * 86400, 365 * 86400]
+
+# graphs can be drawn between these Unix times (1970 to 2500)
+MIN_TIME, MAX_TIME = 0, 16725225600
+
+
+def lttb(x, y, n):
+    """Indices of the n points of (x, y) kept by largest-triangle-three-buckets:
+    the first and last points, and from each of n - 2 buckets of equal size in
+    between, the point forming the largest triangle with the point kept from
+    the bucket before and the mean of the bucket after. The bucket means and
+    areas are computed with numpy; only the choice of points runs bucket by
+    bucket, as each depends on the one before."""
+    size = len(x)
+    if size <= n or n < 3:
+        return np.arange(size)
+
+    edges = np.linspace(1, size - 1, n - 1).astype(np.int64)
+    counts = np.diff(edges)
+    # mean of each bucket; the last point stands in for the bucket after the last
+    mean_x = np.append(np.add.reduceat(x[:-1], edges[:-1]) / counts, x[-1])
+    mean_y = np.append(np.add.reduceat(y[:-1], edges[:-1]) / counts, y[-1])
+
+    kept = np.empty(n, dtype=np.int64)
+    kept[0], kept[-1] = 0, size - 1
+    a = 0
+    for i in range(n - 2):
+        lo, hi = edges[i], edges[i + 1]
+        # twice the areas of the triangles, up to sign
+        area = np.abs(
+            (x[a] - mean_x[i + 1]) * (y[lo:hi] - y[a]) - (x[a] - x[lo:hi]) * (mean_y[i + 1] - y[a])
+        )
+        a = lo + int(np.argmax(area))
+        kept[i + 1] = a
+    return kept
+
+
+def resolution_for(start, end):
+    """The resolution (seconds) to draw start..end at: 60 (raw data), or that of
+    the finest rollup with at most MAX_ROWS buckets in the range."""
+    for resolution in [60, *sorted(db.ROLLUP_RESOLUTIONS.values())]:
+        if (end - start) / resolution <= MAX_ROWS:
+            return resolution
+    return max(db.ROLLUP_RESOLUTIONS.values())
+
+
+def read(reactor, start, end, resolution):
+    """A reactor's COLUMNS between start and end at the given resolution, as a
+    float array sorted by time, with NULLs as NaN. Rollup buckets are placed
+    at their middle."""
+    chunks = [np.empty((0, len(COLUMNS)))]
+    if resolution == 60:
+        for _, rows in archive.iter_chunks(start, end, columns=COLUMNS, reactor=reactor):
+            if rows:
+                chunks.append(np.array(rows, dtype=float))
+    else:
+        for _, rows in db.iter_chunks(
+            "get_rollup_series",
+            resolution=resolution,
+            reactor=reactor,
+            start_timestamp=start - resolution + 1,
+            end_timestamp=end,
+        ):
+            if rows:
+                a = np.array(rows, dtype=float)
+                a[:, 0] += resolution / 2
+                chunks.append(a)
+    a = np.concatenate(chunks)
+    return a[np.argsort(a[:, 0], kind="stable")]
+
+
+def nice_step(span, ticks=6):
+    """A round step (1, 2 or 5 times a power of ten) for about `ticks` ticks."""
+    raw = span / ticks
+    power = 10 ** math.floor(math.log10(raw))
+    return next(m * power for m in (1, 2, 5, 10) if m * power >= raw)
+
+
+def render(reactor, start, end, width=1200, height=600, tz=timezone.utc):
+    """A graph of a reactor from start to end (Unix times) as an SVG document.
+    Each series is downsampled to one point per pixel column."""
+    resolution = resolution_for(start, end)
+    a = read(reactor, start, end, resolution)
+
+    left, right, top, bottom = 60, 20, 50, 40
+    plot_w, plot_h = width - left - right, height - top - bottom
+    values = a[:, 1:]
+    finite = values[np.isfinite(values)]
+    lo = min(-5.0, float(finite.min())) if finite.size else -5.0
+    hi = max(75.0, float(finite.max())) if finite.size else 75.0
+
+    def px(t):
+        return left + (t - start) / (end - start) * plot_w
+
+    def py(v):
+        return top + (hi - v) / (hi - lo) * plot_h
+
+    out = [
+        f'<svg xmlns="http://www.w3.org/2000/svg" width="{width}" height="{height}" '
+        f'viewBox="0 0 {width} {height}" font-family="Helvetica, sans-serif" font-size="12">',
+        f'<rect width="{width}" height="{height}" fill="white"/>',
+    ]
+
+    # value axis
+    step = nice_step(hi - lo)
+    for v in np.arange(math.ceil(lo / step) * step, hi + step / 2, step):
+        y = py(v)
+        out.append(f'<line x1="{left}" x2="{left + plot_w}" y1="{y:.1f}" y2="{y:.1f}" stroke="#ddd"/>')
+        out.append(f'<text x="{left - 6}" y="{y + 4:.1f}" text-anchor="end">{v:g}</text>')
+    out.append(
+        f'<text transform="translate(14 {top + plot_h / 2}) rotate(-90)" text-anchor="middle">'
+        "Flow [ml/min] / H2 [%] / CO2 [%]</text>"
+    )
+
+    # time axis, with ticks at round local times
+    step = next((s for s in TIME_STEPS if (end - start) / s <= 8), None)
+    if step is None:
+        step = 365 * 86400 * nice_step((end - start) / (365 * 86400), ticks=8)
+    offset = datetime.fromtimestamp(start, tz).utcoffset().total_seconds()
+    fmt = "%Y-%m-%d" if step >= 86400 else "%m-%d %H:%M"
+    for t in np.arange(math.ceil((start + offset) / step) * step - offset, end + 1, step):
+        x = px(t)
+        label = datetime.fromtimestamp(t, tz).strftime(fmt)
+        out.append(f'<line x1="{x:.1f}" x2="{x:.1f}" y1="{top}" y2="{top + plot_h}" stroke="#ddd"/>')
+        out.append(f'<text x="{x:.1f}" y="{top + plot_h + 16}" text-anchor="middle">{label}</text>')
+
+    out.append(f'<rect x="{left}" y="{top}" width="{plot_w}" height="{plot_h}" fill="none" stroke="#888"/>')
+
+    # title, range and legend
+    span = " to ".join(datetime.fromtimestamp(t, tz).strftime("%Y-%m-%d %H:%M") for t in (start, end))
+    out.append(f'<text x="{left}" y="20" font-size="16">Reactor {escape(str(reactor))}</text>')
+    out.append(f'<text x="{left}" y="38" fill="#666">{span} ({SOURCE_NAMES.get(resolution, "")})</text>')
+    for i, (_, name, colour) in enumerate(SERIES):
+        x = left + plot_w - 110 * (len(SERIES) - i)
+        out.append(f'<rect x="{x}" y="28" width="12" height="12" fill="{colour}"/>')
+        out.append(f'<text x="{x + 16}" y="38">{name}</text>')
+
+    # the series, as polylines broken at gaps; each run between gaps gets its
+    # share of the graph's width
+    max_gap = max(MAX_GAP, 2 * resolution)
+    for col, (_, _, colour) in zip(range(1, len(COLUMNS)), SERIES):
+        mask = np.isfinite(a[:, col])
+        t, v = a[mask, 0], a[mask, col]
+        if not len(t):
+            continue
+        runs = np.split(np.arange(len(t)), np.flatnonzero(np.diff(t) > max_gap) + 1)
+        for run in runs:
+            if len(run) == 1:
+                out.append(f'<circle cx="{px(t[run[0]]):.1f}" cy="{py(v[run[0]]):.1f}" r="1.5" fill="{colour}"/>')
+                continue
+            kept = run[lttb(t[run], v[run], max(3, math.ceil(plot_w * len(run) / len(t))))]
+            points = " ".join(f"{x:.1f},{y:.1f}" for x, y in zip(px(t[kept]), py(v[kept])))
+            out.append(f'<polyline points="{points}" fill="none" stroke="{colour}" stroke-width="1.5"/>')
+
+    if not len(a):
+        out.append(
+            f'<text x="{left + plot_w / 2}" y="{top + plot_h / 2}" text-anchor="middle" fill="#666">No data</text>'
+        )
+    out.append("</svg>")
+    return "\n".join(out)
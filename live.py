@@ -0,0 +1,114 @@
+# live.py --
+#   shared-memory ring buffer of the latest readings. the logger publishes
+#   every sample to it, and the web app streams new samples from it to
+#   browsers as server-sent events, without touching the database.
+
+import os
+import json
+import time
+
+import numpy as np
+
+import metrics
+
+LIVE_FILE = os.path.join(metrics.SHM_DIR, "gasmix-live.bin")
+SLOTS = 1024
+
+# interim is set for the flow estimates published between full minutes (see
+# main.py), which are superseded by the next sample
+FIELDS = ("read_time", "reactor", "vol", "h2", "co2", "temp", "pressure", "humidity", "interim")
+HEADER = np.dtype([("head", "<u8")])  # sequence number of the latest sample
+RECORD = np.dtype([("seq", "<u8")] + [(f, "<f8") for f in FIELDS])
+
+ring = None
+
+
+class Ring:
+    """A file of a header and `slots` records. Sample number s (counting from
+    1) goes in slot s % slots. Each record carries its sequence number, which
+    the writer zeroes while it fills the record in; a reader only accepts a
+    record if its sequence number is the expected one both before and after
+    copying it."""
+
+    def __init__(self, path, slots=SLOTS, write=False):
+        size = HEADER.itemsize + slots * RECORD.itemsize
+        if write and (not os.path.exists(path) or os.path.getsize(path) != size):
+            with open(path, "wb") as f:
+                f.truncate(size)
+        mode = "r+" if write else "r"
+        self.header = np.memmap(path, HEADER, mode, shape=1)
+        self.records = np.memmap(path, RECORD, mode, offset=HEADER.itemsize, shape=slots)
+        self.slots = slots
+
+    @property
+    def head(self):
+        return int(self.header["head"][0])
+
+    def write(self, sample):
+        seq = self.head + 1
+        i = seq % self.slots
+        self.records[i] = (0, *(sample.get(f, np.nan) for f in FIELDS))
+        self.records["seq"][i] = seq
+        self.header["head"] = seq
+
+    def read(self, after):
+        """Samples newer than sequence number `after` (at most a ring's worth),
+        as (seq, dict) pairs."""
+        head = self.head
+        if after > head:
+            # the ring was recreated (e.g. after a reboot)
+            after = head
+        samples = []
+        for seq in range(max(after + 1, head - self.slots + 1), head + 1):
+            i = seq % self.slots
+            record = self.records[i].copy()
+            if record["seq"] != seq or self.records["seq"][i] != seq:
+                continue  # overwritten while we were reading
+            samples.append(
+                (seq, {f: None if np.isnan(record[f]) else record[f].item() for f in FIELDS})
+            )
+        return samples
+
+
+def publish(samples):
+    """Add samples (dicts with some or all of FIELDS) to the ring."""
+    global ring
+    if ring is None:
+        ring = Ring(LIVE_FILE, write=True)
+    for sample in samples:
+        ring.write(sample)
+
+
+def open_ring(path=None):
+    """The ring for reading, or None if the logger has not created it yet."""
+    try:
+        return Ring(path or LIVE_FILE)
+    except (FileNotFoundError, ValueError):
+        return None
+
+
+def event_stream(last_id=None, reactors=None, interval=0.2, heartbeat=15):
+    """Server-sent events of the samples published from now on, or from
+    after `last_id` if it is still in the ring. Ends when the client
+    disconnects."""
+    reader = open_ring()
+    after = last_id if last_id is not None else (reader.head if reader else 0)
+    quiet = 0.0
+    while True:
+        if reader is None:
+            reader = open_ring()
+        events = []
+        for seq, sample in reader.read(after) if reader else []:
+            after = seq
+            if reactors and sample["reactor"] not in reactors:
+                continue
+            events.append(f"id: {seq}\ndata: {json.dumps(sample)}\n\n")
+
+        if events:
+            quiet = 0.0
+            yield "".join(events).encode()
+        elif quiet >= heartbeat:
+            quiet = 0.0
+            yield b": keepalive\n\n"  # lets the server notice closed connections
+        time.sleep(interval)
+        quiet += interval
@@ -1,4 +1,5 @@
 import os
+import sys
 import time
 import argparse
 from collections import deque
@@ -7,10 +8,33 @@ import numpy as np
 
 import db
 import rrd
-from gas_switch import activate_rocker, cleanup
-from sensors import BlueVary, BlueVCount
+import live
+import config
+import yields
+import metrics
+from acquire import Acquisition
+from devices import GuardedAnalyser, GuardedCounter
+from flow import FlowEstimator
+from scheduler import Scheduler
+from steady import SteadyStateDetector
+
+# device timeouts in seconds
+ANALYSER_TIMEOUT = 1
+COUNTER_TIMEOUT = 0.1
+
+# seconds; between full minutes, the metrics (e.g. the flow estimates) are
+# published at most this often
+METRICS_INTERVAL = 5
+
+
+def poll_rate(value):
+    """argparse type for --poll-rate: 0, or a rate that rounds to at least one
+    poll per minute (the scheduler's period is 60 / round(60 * rate))."""
+    rate = float(value)
+    if rate < 0 or (rate > 0 and round(60 * rate) < 1):
+        raise argparse.ArgumentTypeError(f"{value} rounds to no polls per minute; use 0 or at least 1/120")
+    return rate
 
-print("Gas logger and controller starting up.")
 
 parser = argparse.ArgumentParser()
 parser.add_argument("-v", "--verbose", action="store_true", help="Enable verbose mode")
@@ -26,107 +50,316 @@ parser.add_argument(
     "--device",
     type=str,
     default=None,
-    help="Device entry for the USB to RS485 adapter (default: first /dev/ttyUSB* entry)",
+    help="Device entry for the USB to RS485 adapter, for a bus without a device in the "
+    "config file (default: first /dev/ttyUSB* entry)",
 )
 parser.add_argument(
     "-n",
     "--num-reactors",
     type=int,
-    default=3,
-    choices=range(1, 4),  # Allows values 1, 2, or 3
-    help="Number of reactors to track (default: 3, min: 1, max: 3)",
+    default=None,
+    help="Number of reactors to track, i.e. the first N of the config file (default: all)",
+)
+parser.add_argument(
+    "-a",
+    "--adaptive",
+    action="store_true",
+    help="Move on to the next reactor as soon as H2/CO2 have settled. "
+    "The cycle length is then the maximum time per reactor",
+)
+parser.add_argument(
+    "--min-dwell",
+    type=int,
+    default=10,
+    help="Minimum minutes per reactor in adaptive mode (default: 10)",
+)
+parser.add_argument(
+    "--settle-window",
+    type=int,
+    default=5,
+    help="Readings (minutes) that must be stable to count as settled (default: 5)",
+)
+parser.add_argument(
+    "--settle-slope",
+    type=float,
+    default=0.05,
+    help="Maximum H2/CO2 slope in %%/min to count as settled (default: 0.05)",
+)
+parser.add_argument(
+    "--settle-std",
+    type=float,
+    default=0.5,
+    help="Maximum H2/CO2 standard deviation in %% to count as settled (default: 0.5)",
+)
+parser.add_argument(
+    "-p",
+    "--poll-rate",
+    type=poll_rate,
+    default=0,
+    help="Poll the gas counters this many times per second, and fit flows over the last "
+    "minute of readings (default: 0, i.e. compare two readings one minute apart)",
+)
+parser.add_argument(
+    "-r",
+    "--retention-days",
+    type=int,
+    default=db.RETENTION_DAYS,
+    help=f"Delete data older than this many days (default: {db.RETENTION_DAYS})",
 )
-args = parser.parse_args()
-
-VERBOSE = args.verbose
-CYCLE_LENGTH = args.cycle_length
-NUM_REACTORS = args.num_reactors
-
-
-def get_vols(counters):
-    return [counter.get_vol() for counter in counters]
-
-
-# set up the rrd
-rrd.create_rrds(rrd.missing_files())
 
-# set up db
-db.init()
-if not os.path.exists(db.DB_FILE):
-    db.rebuild_db()
 
-# connect to sensors
-if not args.device:
+def find_usb_device():
+    """Returns the first /dev/ttyUSB* entry."""
     devs = []
     with os.scandir("/dev") as d:
         for entry in d:
             if entry.name.startswith("ttyUSB"):
                 devs.append("/dev/" + entry.name)
     if devs:
-        USB_DEV = sorted(devs)[0]
+        return sorted(devs)[0]
     else:
         raise IOError("No USB device found for RS485 communication.")
-else:
-    USB_DEV = args.device
-
-assert os.access(
-    USB_DEV, mode=os.R_OK | os.W_OK
-), f"USB device ({USB_DEV}) not accessible."
-print(f"Using {USB_DEV} for serial communication.")
-
-bv = BlueVary("192.168.10.230")
-bcs = [BlueVCount(USB_DEV, 1), BlueVCount(USB_DEV, 2), BlueVCount(USB_DEV, 3)]
-bcs[0].serial.baudrate = 38400
-bcs[0].serial.stopbits = 2
-
-# use this to keep track of which reactor is being measured
-reactors = deque(range(NUM_REACTORS))
-
-try:
-    while True:
-        # outer loop: this is for measuring H2/CO2.
-        # we need to use a relatively long time for this measurement (settable via --cycle-length)
-        r = reactors[0]  # reactor currently being sampled
-        reactors.rotate(-1)
-        activate_rocker(r)
-        outerloopstart = time.monotonic()
-
-        while time.monotonic() - outerloopstart < CYCLE_LENGTH * 60:
-            # inner loop: this is for measuring flows. data is collected roughly every minute.
-            loopstart = time.monotonic()
-            init_vols = get_vols(bcs)
-
-            while time.monotonic() - loopstart < 60:
-                time.sleep(0.01)
-            end_vols = get_vols(bcs)
+
+
+def settled_comment(detector):
+    h2, co2 = detector.value()
+    return f"settled: h2={h2:.2f} co2={co2:.2f}"
+
+
+class Channel:
+    """A gas analyser and the reactors it samples in turn."""
+
+    def __init__(self, name, reactors, detector=None):
+        self.name = name
+        self.reactors = deque(reactors)  # the next reactor to sample is first
+        self.detector = detector
+        self.r = None  # reactor currently being sampled
+        self.switch_minute = None  # minute at which we switched to r
+        self.settled = False
+
+
+def run(
+    acq,
+    activate_rocker,
+    writer,
+    sched,
+    channels,
+    cycle_length,
+    verbose=False,
+    minutes=None,
+    min_dwell=0,
+    estimator=None,
+):
+    """The logger loop. Runs forever, or for the given number of minutes.
+
+    There is one Channel per analyser of acq, in the same order. Each
+    analyser moves on to its next reactor every cycle_length minutes or, if
+    its channel has a SteadyStateDetector, as soon as the readings have
+    settled (but not before min_dwell minutes).
+
+    If a FlowEstimator is given, the scheduler may tick several times per
+    minute. The counters are then read on every tick, and flows are fitted
+    over the last minute of readings instead of taken from two readings."""
+    ticks_per_minute = round(60 / sched.interval)
+
+    minute = None  # minutes since start
+    prev_snaps = None
+    published = time.monotonic()
+
+    while minutes is None or minute is None or minute + 1 < minutes:
+        tick = sched.wait()
+        metrics.observe("tick_jitter_seconds", sched.jitter)
+        metrics.set_gauge("tick_overruns", sched.overruns)
+
+        if tick // ticks_per_minute == minute:
+            # between full minutes, only poll the counters
+            snaps = acq.read_counters()
+            estimator.add(snaps)
+            flows = estimator.flows()
+            for cur_r, flow in enumerate(flows):
+                metrics.set_gauge("flow_ml_per_min", flow, reactor=cur_r)
+            live.publish(
+                dict(
+                    read_time=snap.read_time,
+                    reactor=cur_r,
+                    vol=flow,
+                    temp=snap.temp,
+                    pressure=snap.pressure,
+                    interim=1,
+                )
+                for cur_r, (snap, flow) in enumerate(zip(snaps, flows))
+            )
+            if time.monotonic() - published >= METRICS_INTERVAL:
+                metrics.publish()
+                published = time.monotonic()
+            continue
+        minute = tick // ticks_per_minute
+
+        with metrics.timer("acquisition_seconds"):
+            gases, snaps = acq.read_all()
+        if estimator is not None:
+            estimator.add(snaps)
+
+        for ch in channels:
+            ch.settled = False
+        if prev_snaps is not None:
+            if estimator is not None:
+                flows = list(estimator.flows())
+            else:
+                # flows are calculated from the capture times of the two snapshots
+                flows = [
+                    (x.vol - y.vol) / ((x.t - y.t) / 60) for x, y in zip(snaps, prev_snaps)
+                ]
+
+            # the gas readings and channels of the reactors currently on an analyser
+            sampled = {}
+            for ch, gas in zip(channels, gases):
+                if ch.r is None:
+                    continue
+                sampled[ch.r] = gas, ch
+                if ch.detector is not None:
+                    ch.detector.add(gas.t, gas.h2, gas.co2)
+                    ch.settled = minute - ch.switch_minute >= min_dwell and ch.detector.settled()
 
             rrd.record_data(
-                flows=(
-                    flows := [
-                        (x - y) / ((time.monotonic() - loopstart) / 60)
-                        for x, y in zip(end_vols, init_vols)
-                    ]
-                ),
-                reactor=r,
-                h2=(h2 := bv.get_h2()),
-                co2=(co2 := bv.get_co2()),
+                flows=flows,
+                gas={r: (gas.h2, gas.co2) for r, (gas, _) in sampled.items()},
+                timestamp=int(snaps[0].read_time),
             )
-            if VERBOSE:
-                print(f"{flows=} {h2=} {co2=}")
+            if verbose:
+                gas = {r: (round(g.h2, 2), round(g.co2, 2)) for r, (g, _) in sampled.items()}
+                print(f"{flows=} h2/co2={gas} jitter={sched.jitter:.3f} overruns={sched.overruns}")
 
-            for cur_r in range(NUM_REACTORS):
-                db.queries.insert_sensordata(
-                    id=None,
-                    read_time=int(time.time()),
-                    reactor=cur_r,
-                    vol=flows[cur_r],
-                    h2=h2 if cur_r == r else np.nan,
-                    co2=co2 if cur_r == r else np.nan,
-                    temp=bcs[cur_r].get_temp(),
-                    pressure=bcs[cur_r].get_pressure(),
-                    humidity=bv.get_humidity() if cur_r == r else np.nan,
-                    comment="",
+            rows = []
+            for cur_r, (snap, flow) in enumerate(zip(snaps, flows)):
+                gas, ch = sampled.get(cur_r, (None, None))
+                rows.append(
+                    dict(
+                        id=None,
+                        read_time=int(snap.read_time),
+                        reactor=cur_r,
+                        vol=flow,
+                        h2=gas.h2 if gas else np.nan,
+                        co2=gas.co2 if gas else np.nan,
+                        temp=snap.temp,
+                        pressure=snap.pressure,
+                        humidity=gas.humidity if gas else np.nan,
+                        comment=settled_comment(ch.detector) if ch and ch.settled else "",
+                    )
                 )
+            writer.submit(rows)
+            live.publish(rows)
+        prev_snaps = snaps
+
+        # measuring H2/CO2 needs a relatively long time per reactor (settable via --cycle-length)
+        for ch in channels:
+            if not ch.reactors:
+                continue
+            if ch.r is None or ch.settled or minute - ch.switch_minute >= cycle_length:
+                if verbose and ch.r is not None:
+                    print(
+                        f"Reactor {ch.r} sampled for {minute - ch.switch_minute} min "
+                        f"on {ch.name}, settled={ch.settled}"
+                    )
+                ch.r = ch.reactors[0]
+                ch.reactors.rotate(-1)
+                activate_rocker(ch.r)
+                ch.switch_minute = minute
+                if ch.detector is not None:
+                    ch.detector.reset()
+                metrics.set_gauge("sampled_reactor", ch.r, analyser=ch.name)
+
+        metrics.publish()
+        published = time.monotonic()
+
+
+def main():
+    print("Gas logger and controller starting up.")
+    args = parser.parse_args()
+
+    try:
+        topology = config.load(num_reactors=args.num_reactors)
+    except config.ConfigError as e:
+        sys.exit(f"Invalid configuration: {e}")
+    num_reactors = topology["num_reactors"]
+
+    # hardware drivers are only needed here, so the loop can run without them (see simulate.py)
+    from gas_switch import activate_rocker, cleanup, setup
+    from sensors import BlueVary, BlueVCount
+
+    # set up the rrd
+    rrd.create_rrds(rrd.missing_files(num_reactors))
+
+    # set up db
+    db.init()
+    db.migrate()
+    yields.update()  # catch up with rows written while the logger was not running
+    writer = db.Writer(retention_days=args.retention_days, on_insert=yields.update)
+    writer.start()
+
+    # connect to sensors. the counters on a bus share it, so their reads are bounded by
+    # the serial timeout rather than by a guard timeout (see devices.py)
+    buses = []
+    for bus in topology["buses"]:
+        usb_dev = bus["device"] or args.device or find_usb_device()
+        assert os.access(
+            usb_dev, mode=os.R_OK | os.W_OK
+        ), f"USB device ({usb_dev}) not accessible."
+        print(f"Using {usb_dev} for serial communication.")
+
+        bcs = [BlueVCount(usb_dev, address) for address in bus["addresses"]]
+        bcs[0].serial.baudrate = bus["baudrate"]
+        bcs[0].serial.stopbits = bus["stopbits"]
+        bcs[0].serial.timeout = COUNTER_TIMEOUT
+        if len(topology["buses"]) > 1:
+            for bc in bcs:
+                bc.bus = os.path.basename(usb_dev) + "-"
+        buses.append([GuardedCounter(bc, bc.name) for bc in bcs])
+
+    analysers = []
+    for analyser in topology["analysers"]:
+        bv = BlueVary(analyser["host"], timeout=ANALYSER_TIMEOUT, retries=0)
+        bv.name = analyser["name"]
+        analysers.append(GuardedAnalyser(bv, bv.name, timeout=2 * ANALYSER_TIMEOUT))
+    acq = Acquisition(analysers, buses)
+    setup(topology["rockers"], [analyser["reactors"] for analyser in topology["analysers"]])
+
+    sched = Scheduler(60)
+    estimator = None
+    if args.poll_rate > 0:
+        sched = Scheduler(60 / round(60 * args.poll_rate))
+        estimator = FlowEstimator(num_reactors, 2 * round(60 * args.poll_rate))
+
+    channels = [
+        Channel(
+            analyser["name"],
+            analyser["reactors"],
+            SteadyStateDetector(args.settle_window, args.settle_slope, args.settle_std)
+            if args.adaptive
+            else None,
+        )
+        for analyser in topology["analysers"]
+    ]
+
+    try:
+        run(
+            acq,
+            activate_rocker,
+            writer,
+            sched,
+            channels,
+            cycle_length=args.cycle_length,
+            verbose=args.verbose,
+            min_dwell=args.min_dwell,
+            estimator=estimator,
+        )
+    finally:
+        acq.close()
+        for analyser in analysers:
+            analyser.close()
+        writer.close()
+        cleanup()  # clean up GPIO
+
 
-finally:
-    cleanup()  # clean up GPIO
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,138 @@
+# metrics.py --
+#   lightweight in-process metrics (counters, gauges, histograms) in prometheus
+#   text format. the logger publishes its metrics to a small json file in shared
+#   memory, which the web app serves together with its own at /metrics.
+
+import os
+import json
+import time
+import bisect
+import tempfile
+import threading
+from contextlib import contextmanager
+
+SHM_DIR = "/dev/shm" if os.path.isdir("/dev/shm") else tempfile.gettempdir()
+METRICS_FILE = os.path.join(SHM_DIR, "gasmix-metrics.json")
+
+# histogram bucket upper bounds, in seconds
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+
+class Histogram:
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # the last one is +Inf
+        self.sum = 0.0
+        self.lock = threading.Lock()
+
+    def observe(self, value):
+        i = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            self.counts[i] += 1
+            self.sum += value
+
+
+counters = {}
+gauges = {}
+histograms = {}
+_lock = threading.Lock()
+
+
+def key(name, labels):
+    return name, tuple(sorted(labels.items()))
+
+
+def inc(name, value=1, **labels):
+    k = key(name, labels)
+    with _lock:
+        counters[k] = counters.get(k, 0) + value
+
+
+def set_gauge(name, value, **labels):
+    k = key(name, labels)
+    with _lock:
+        gauges[k] = value
+
+
+def observe(name, value, **labels):
+    k = key(name, labels)
+    hist = histograms.get(k)
+    if hist is None:
+        with _lock:
+            hist = histograms.setdefault(k, Histogram())
+    hist.observe(value)
+
+
+@contextmanager
+def timer(name, **labels):
+    """Observe the time spent in the with block in the named histogram."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(name, time.perf_counter() - start, **labels)
+
+
+def snapshot():
+    """All metrics as a json-serialisable dict."""
+    with _lock:
+        return {
+            "counters": [[n, dict(l), v] for (n, l), v in counters.items()],
+            "gauges": [[n, dict(l), v] for (n, l), v in gauges.items()],
+            "histograms": [
+                [n, dict(l), list(h.buckets), list(h.counts), h.sum]
+                for (n, l), h in histograms.items()
+            ],
+        }
+
+
+def publish(path=None):
+    """Atomically write a snapshot for other processes to read."""
+    path = path or METRICS_FILE
+    tmp = f"{path}.{os.getpid()}"
+    with open(tmp, "w") as f:
+        json.dump(snapshot(), f)
+    os.replace(tmp, path)
+
+
+def load(path=None):
+    """Read a published snapshot, or None if there is none."""
+    try:
+        with open(path or METRICS_FILE) as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return None
+
+
+def format_labels(labels, **extra):
+    labels = {**labels, **extra}
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{k}="{v}"' for k, v in sorted(labels.items())) + "}"
+
+
+def render(snap):
+    """Prometheus text exposition format of a snapshot."""
+    lines = []
+    typed = set()
+
+    def type_line(name, kind):
+        if name not in typed:
+            typed.add(name)
+            lines.append(f"# TYPE {name} {kind}")
+
+    for name, labels, value in snap["counters"]:
+        type_line(name, "counter")
+        lines.append(f"{name}{format_labels(labels)} {value}")
+    for name, labels, value in snap["gauges"]:
+        type_line(name, "gauge")
+        lines.append(f"{name}{format_labels(labels)} {value}")
+    for name, labels, buckets, counts, total in snap["histograms"]:
+        type_line(name, "histogram")
+        cumulative = 0
+        for le, count in zip([*buckets, "+Inf"], counts):
+            cumulative += count
+            lines.append(f"{name}_bucket{format_labels(labels, le=le)} {cumulative}")
+        lines.append(f"{name}_sum{format_labels(labels)} {total}")
+        lines.append(f"{name}_count{format_labels(labels)} {cumulative}")
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,10 @@
+-- :name backfill_rollup :affected
+-- (re)build the rollup at one resolution from all data in sensordata
+INSERT OR REPLACE INTO rollup
+SELECT :resolution, (read_time / :resolution) * :resolution AS bucket, reactor,
+    total(vol), min(vol), max(vol), count(vol),
+    total(h2), min(h2), max(h2), count(h2),
+    total(co2), min(co2), max(co2), count(co2),
+    total(temp), min(temp), max(temp), count(temp),
+    total(pressure), min(pressure), max(pressure), count(pressure)
+FROM sensordata GROUP BY bucket, reactor
@@ -0,0 +1,2 @@
+-- :name create_index_sensordata_time :affected
+CREATE INDEX IF NOT EXISTS sensordata_time ON sensordata (read_time, reactor);
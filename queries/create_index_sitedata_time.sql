@@ -0,0 +1,2 @@
+-- :name create_index_sitedata_time :affected
+CREATE INDEX sitedata_time ON sitedata (site, read_time, reactor)
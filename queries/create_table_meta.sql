@@ -0,0 +1,3 @@
+-- :name create_table_meta :affected
+-- one row is added per applied schema migration
+CREATE TABLE IF NOT EXISTS meta (created REAL, version INT);
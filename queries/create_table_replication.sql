@@ -0,0 +1,2 @@
+-- :name create_table_replication :affected
+CREATE TABLE replication (url TEXT PRIMARY KEY, last_id INT)
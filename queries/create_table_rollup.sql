@@ -0,0 +1,10 @@
+-- :name create_table_rollup :affected
+-- per-reactor aggregates of sensordata at several resolutions (in seconds).
+-- bucket is the unix time at the start of each interval, means are <col>_sum / <col>_n
+CREATE TABLE IF NOT EXISTS rollup (resolution INT, bucket INT, reactor NUM,
+    vol_sum REAL, vol_min REAL, vol_max REAL, vol_n INT,
+    h2_sum REAL, h2_min REAL, h2_max REAL, h2_n INT,
+    co2_sum REAL, co2_min REAL, co2_max REAL, co2_n INT,
+    temp_sum REAL, temp_min REAL, temp_max REAL, temp_n INT,
+    pressure_sum REAL, pressure_min REAL, pressure_max REAL, pressure_n INT,
+    PRIMARY KEY (resolution, bucket, reactor));
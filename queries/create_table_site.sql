@@ -0,0 +1,2 @@
+-- :name create_table_site :affected
+CREATE TABLE site (name TEXT PRIMARY KEY, last_id INT, last_seen REAL)
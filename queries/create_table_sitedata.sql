@@ -0,0 +1,3 @@
+-- :name create_table_sitedata :affected
+CREATE TABLE sitedata (site TEXT, id INTEGER, read_time INT, reactor NUM, vol NUM, h2 NUM, co2 NUM, temp NUM, pressure NUM, humidity NUM, comment TEXT,
+    PRIMARY KEY (site, id))
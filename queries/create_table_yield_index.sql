@@ -0,0 +1,3 @@
+-- :name create_table_yield_index :affected
+CREATE TABLE yield_index (reactor INT, read_time INT, gas REAL, h2 REAL, co2 REAL, measured INT,
+    h2_pct REAL, co2_pct REAL, PRIMARY KEY (reactor, read_time)) WITHOUT ROWID
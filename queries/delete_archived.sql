@@ -0,0 +1,7 @@
+-- :name delete_archived :affected
+-- delete a batch of rows that have been written to an archive file. rows
+-- inserted after the archive file was written have higher ids and are kept
+DELETE FROM sensordata WHERE id IN
+    (SELECT id FROM sensordata
+     WHERE read_time >= :start_timestamp AND read_time < :end_timestamp AND id <= :max_id
+     LIMIT :batch_size)
@@ -0,0 +1,2 @@
+-- :name delete_yield_index_from :affected
+DELETE FROM yield_index WHERE read_time >= :start
@@ -0,0 +1,2 @@
+-- :name drop_table_yield_index :affected
+DROP TABLE IF EXISTS yield_index
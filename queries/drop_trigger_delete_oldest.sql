@@ -0,0 +1,3 @@
+-- :name drop_trigger_delete_oldest :affected
+-- retention is handled by db.prune() instead, see Database.md
+DROP TRIGGER IF EXISTS delete_oldest;
@@ -0,0 +1,3 @@
+-- :name extract_reactor_data :many
+SELECT * FROM sensordata
+WHERE read_time >= :start_timestamp AND read_time <= :end_timestamp AND reactor = :reactor
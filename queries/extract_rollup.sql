@@ -0,0 +1,9 @@
+-- :name extract_rollup :many
+SELECT bucket AS read_time, reactor,
+    vol_sum / vol_n AS vol, vol_min, vol_max, vol_n,
+    h2_sum / h2_n AS h2, h2_min, h2_max, h2_n,
+    co2_sum / co2_n AS co2, co2_min, co2_max, co2_n,
+    temp_sum / temp_n AS temp, temp_min, temp_max, temp_n,
+    pressure_sum / pressure_n AS pressure, pressure_min, pressure_max, pressure_n
+FROM rollup WHERE resolution = :resolution AND bucket >= :start_timestamp AND bucket <= :end_timestamp
+ORDER BY bucket, reactor
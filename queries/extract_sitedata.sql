@@ -0,0 +1,2 @@
+-- :name extract_sitedata :many
+SELECT * FROM sitedata WHERE site = :site AND read_time >= :start_timestamp AND read_time <= :end_timestamp
@@ -0,0 +1,2 @@
+-- :name get_last_read_time :scalar
+SELECT MAX(read_time) FROM sensordata
@@ -0,0 +1,2 @@
+-- :name get_oldest_read_time :scalar
+SELECT MIN(read_time) FROM sensordata
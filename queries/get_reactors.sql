@@ -0,0 +1,2 @@
+-- :name get_reactors :many
+SELECT DISTINCT reactor FROM rollup WHERE resolution = :resolution
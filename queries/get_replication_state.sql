@@ -0,0 +1,2 @@
+-- :name get_replication_state :scalar
+SELECT last_id FROM replication WHERE url = :url
@@ -0,0 +1,4 @@
+-- :name get_rollup_series :many
+SELECT bucket AS read_time, vol_sum / vol_n AS vol, h2_sum / h2_n AS h2, co2_sum / co2_n AS co2
+FROM rollup WHERE resolution = :resolution AND reactor = :reactor AND bucket >= :start_timestamp AND bucket <= :end_timestamp
+ORDER BY bucket
@@ -0,0 +1,2 @@
+-- :name get_rows_after :many
+SELECT * FROM sensordata WHERE id > :last_id ORDER BY id LIMIT :batch_size
@@ -0,0 +1,2 @@
+-- :name get_schema_version :scalar
+SELECT MAX(version) FROM meta
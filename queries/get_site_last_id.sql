@@ -0,0 +1,2 @@
+-- :name get_site_last_id :scalar
+SELECT MAX(id) FROM sitedata WHERE site = :site
@@ -0,0 +1,3 @@
+-- :name get_sitedata_keys :many
+-- the time and reactor of a site's rows in a range of ids
+SELECT id, read_time, reactor FROM sitedata WHERE site = :site AND id >= :first_id AND id <= :last_id
@@ -0,0 +1,2 @@
+-- :name get_sites :many
+SELECT name, last_id, last_seen FROM site ORDER BY name
@@ -0,0 +1,6 @@
+-- :name get_yield_anchor :one
+-- the last row of a reactor whose composition was measured, or which was
+-- fixed after a long time without measurements. rows after it are
+-- provisional, and are recomputed when the next measurement comes in
+SELECT read_time, gas, h2, co2, h2_pct, co2_pct FROM yield_index WHERE reactor = :reactor AND measured
+ORDER BY read_time DESC LIMIT 1
@@ -0,0 +1,4 @@
+-- :name get_yield_at :one
+-- cumulative production of a reactor up to a time
+SELECT read_time, gas, h2, co2 FROM yield_index WHERE reactor = :reactor AND read_time <= :t
+ORDER BY read_time DESC LIMIT 1
@@ -0,0 +1,2 @@
+-- :name get_yield_last_time :scalar
+SELECT MAX(read_time) FROM yield_index WHERE reactor = :reactor
@@ -0,0 +1,3 @@
+-- :name insert_sitedata :affected
+-- rows that were already received are ignored, so batches can be resent safely
+INSERT OR IGNORE INTO sitedata VALUES (:site, :id, :read_time, :reactor, :vol, :h2, :co2, :temp, :pressure, :humidity, :comment)
@@ -0,0 +1,4 @@
+-- :name prune_sensordata :affected
+-- delete a batch of the oldest rows before the cutoff time
+DELETE FROM sensordata WHERE id IN
+    (SELECT id FROM sensordata WHERE read_time < :cutoff ORDER BY read_time LIMIT :batch_size)
@@ -0,0 +1,2 @@
+-- :name set_replication_state :affected
+INSERT OR REPLACE INTO replication VALUES (:url, :last_id)
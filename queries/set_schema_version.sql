@@ -0,0 +1,2 @@
+-- :name set_schema_version :affected
+INSERT INTO meta VALUES (:created, :version)
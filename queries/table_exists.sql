@@ -0,0 +1,2 @@
+-- :name table_exists :scalar
+SELECT COUNT(*) FROM sqlite_master WHERE type = 'table' AND name = :name
@@ -0,0 +1,29 @@
+-- :name upsert_rollup :affected
+-- add a single sensordata row to its rollup bucket. NaN/NULL values are not counted
+INSERT INTO rollup VALUES (:resolution, (:read_time / :resolution) * :resolution, :reactor,
+    coalesce(:vol, 0.0), :vol, :vol, :vol IS NOT NULL,
+    coalesce(:h2, 0.0), :h2, :h2, :h2 IS NOT NULL,
+    coalesce(:co2, 0.0), :co2, :co2, :co2 IS NOT NULL,
+    coalesce(:temp, 0.0), :temp, :temp, :temp IS NOT NULL,
+    coalesce(:pressure, 0.0), :pressure, :pressure, :pressure IS NOT NULL)
+ON CONFLICT (resolution, bucket, reactor) DO UPDATE SET
+    vol_sum = vol_sum + excluded.vol_sum,
+    vol_min = coalesce(min(vol_min, excluded.vol_min), vol_min, excluded.vol_min),
+    vol_max = coalesce(max(vol_max, excluded.vol_max), vol_max, excluded.vol_max),
+    vol_n = vol_n + excluded.vol_n,
+    h2_sum = h2_sum + excluded.h2_sum,
+    h2_min = coalesce(min(h2_min, excluded.h2_min), h2_min, excluded.h2_min),
+    h2_max = coalesce(max(h2_max, excluded.h2_max), h2_max, excluded.h2_max),
+    h2_n = h2_n + excluded.h2_n,
+    co2_sum = co2_sum + excluded.co2_sum,
+    co2_min = coalesce(min(co2_min, excluded.co2_min), co2_min, excluded.co2_min),
+    co2_max = coalesce(max(co2_max, excluded.co2_max), co2_max, excluded.co2_max),
+    co2_n = co2_n + excluded.co2_n,
+    temp_sum = temp_sum + excluded.temp_sum,
+    temp_min = coalesce(min(temp_min, excluded.temp_min), temp_min, excluded.temp_min),
+    temp_max = coalesce(max(temp_max, excluded.temp_max), temp_max, excluded.temp_max),
+    temp_n = temp_n + excluded.temp_n,
+    pressure_sum = pressure_sum + excluded.pressure_sum,
+    pressure_min = coalesce(min(pressure_min, excluded.pressure_min), pressure_min, excluded.pressure_min),
+    pressure_max = coalesce(max(pressure_max, excluded.pressure_max), pressure_max, excluded.pressure_max),
+    pressure_n = pressure_n + excluded.pressure_n
@@ -0,0 +1,2 @@
+-- :name upsert_site :affected
+INSERT OR REPLACE INTO site VALUES (:name, :last_id, :last_seen)
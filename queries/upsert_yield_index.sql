@@ -0,0 +1,3 @@
+-- :name upsert_yield_index :affected
+INSERT OR REPLACE INTO yield_index
+VALUES (:reactor, :read_time, :gas, :h2, :co2, :measured, :h2_pct, :co2_pct)
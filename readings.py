@@ -0,0 +1,8 @@
+from collections import namedtuple
+
+# a single reading of all counter values, taken in one bus transaction.
+# t is monotonic time (for flow calculations), read_time is unix time (for storage)
+CounterSnapshot = namedtuple("CounterSnapshot", ["t", "read_time", "vol", "pressure", "temp"])
+
+# a single reading of the gas analyser channels, with the same time fields
+GasReading = namedtuple("GasReading", ["t", "read_time", "h2", "co2", "humidity"])
@@ -0,0 +1,212 @@
+# replicate.py --
+#   incremental replication of sensordata from several loggers (sites) to a
+#   central node. each site sends the rows after the last id the central node
+#   has confirmed, as gzipped json lines, to the central web app's
+#   /api/replicate. the central node stores them in sitedata, keyed by
+#   (site, id), and serves them through the extract api (site=...).
+
+import os
+import re
+import sys
+import io
+import gzip
+import json
+import time
+import socket
+import argparse
+import urllib.error
+import urllib.parse
+import urllib.request
+
+import db
+
+BATCH_SIZE = 5000
+
+# largest batch the receiver decompresses, against gzip bombs
+MAX_DECODED_BYTES = 64 * 2**20
+SITE_NAME = re.compile(r"^[A-Za-z0-9_.-]+$")
+
+# columns of the sitedata table
+COLUMNS = ["site", "id", "read_time", "reactor", "vol", "h2", "co2", "temp", "pressure", "humidity", "comment"]
+
+parser = argparse.ArgumentParser()
+subparsers = parser.add_subparsers(dest="command", required=True)
+
+send_parser = subparsers.add_parser("send", help="Send new rows to a central node")
+send_parser.add_argument("url", help="Base URL of the central web app, e.g. http://central:8000")
+send_parser.add_argument("--site", default=socket.gethostname(), help="Name of this site (default: the hostname)")
+send_parser.add_argument("--interval", type=float, default=60, help="Seconds between sends (default: 60)")
+send_parser.add_argument("--once", action="store_true", help="Send what there is and exit")
+send_parser.add_argument(
+    "--token",
+    default=os.environ.get("GASMIX_REPLICATION_TOKEN"),
+    help="Shared secret of the central node (default: $GASMIX_REPLICATION_TOKEN)",
+)
+
+receive_parser = subparsers.add_parser("receive", help="Run a stand-in central node, e.g. for testing")
+receive_parser.add_argument("--port", type=int, default=8001, help="Port to listen on (default: 8001)")
+receive_parser.add_argument("--db", default=None, help="Database file of the central node (default: the usual one)")
+receive_parser.add_argument(
+    "--token",
+    default=os.environ.get("GASMIX_REPLICATION_TOKEN"),
+    help="Shared secret the loggers must send (default: $GASMIX_REPLICATION_TOKEN)",
+)
+
+
+class ReplicationError(Exception):
+    pass
+
+
+def encode(rows):
+    """A batch of rows as gzipped json lines."""
+    return gzip.compress("".join(json.dumps(dict(row)) + "\n" for row in rows).encode())
+
+
+def decode(body):
+    with gzip.GzipFile(fileobj=io.BytesIO(body)) as f:
+        data = f.read(MAX_DECODED_BYTES + 1)
+    if len(data) > MAX_DECODED_BYTES:
+        raise ValueError(f"batch is larger than {MAX_DECODED_BYTES} bytes")
+    return [json.loads(line) for line in data.splitlines() if line.strip()]
+
+
+def post(url, site, token, body, timeout=30):
+    """Send a batch to the central node. Returns the last id of the batch it
+    has stored."""
+    request = urllib.request.Request(
+        url.rstrip("/") + "/api/replicate?" + urllib.parse.urlencode({"site": site}),
+        data=body,
+        headers={
+            "Authorization": f"Bearer {token}",
+            "Content-Type": "application/x-ndjson",
+            "Content-Encoding": "gzip",
+        },
+        method="POST",
+    )
+    try:
+        with urllib.request.urlopen(request, timeout=timeout) as resp:
+            return json.load(resp)["last_id"]
+    except urllib.error.HTTPError as e:
+        try:
+            description = json.load(e).get("description", e.reason)
+        except ValueError:
+            description = e.reason
+        raise ReplicationError(f"{url} refused the batch ({e.code}): {description}") from e
+
+
+def send(url, site, token, batch_size=BATCH_SIZE):
+    """Send all rows the central node has not confirmed yet, in batches.
+    Returns the number of rows sent. The high-water mark is only advanced
+    once the central node confirms it has stored a batch, so an interrupted
+    send is simply resumed (and a resent batch is ignored by the receiver)."""
+    last_id = db.queries.get_replication_state(url=url) or 0
+    sent = 0
+    while rows := list(db.queries.get_rows_after(last_id=last_id, batch_size=batch_size)):
+        confirmed = post(url, site, token, encode(rows))
+        if confirmed != rows[-1]["id"]:
+            raise ReplicationError(f"{url} confirmed id {confirmed}, expected {rows[-1]['id']}")
+        with db.queries.transaction():
+            db.queries.set_replication_state(url=url, last_id=confirmed)
+        last_id = confirmed
+        sent += len(rows)
+    return sent
+
+
+def receive(site, body):
+    """Store a batch from a site. Returns the last id of the batch (or the
+    last id received from the site, for an empty batch). Rows the site has
+    sent before are ignored, but a batch whose ids were already received
+    with other rows is refused with a ReplicationError: the site's ids
+    have restarted, e.g. because its database was recreated."""
+    if not SITE_NAME.match(site or ""):
+        raise ValueError(f"Invalid site name: {site!r}")
+    rows = decode(body)
+    for row in rows:
+        row["site"] = site
+    with db.queries.transaction():
+        if rows:
+            db.queries.insert_sitedata(rows)
+            ids = [row["id"] for row in rows]
+            stored = {
+                row["id"]: (row["read_time"], row["reactor"])
+                for row in db.queries.get_sitedata_keys(site=site, first_id=min(ids), last_id=max(ids))
+            }
+            if any(stored.get(row["id"]) != (row["read_time"], row["reactor"]) for row in rows):
+                raise ReplicationError(
+                    f"Rows with these ids were already received from {site} with other times or reactors. "
+                    "If its database was recreated, send as a new site (--site)"
+                )
+        site_last_id = db.queries.get_site_last_id(site=site)
+        db.queries.upsert_site(name=site, last_id=site_last_id, last_seen=time.time())
+    return rows[-1]["id"] if rows else site_last_id
+
+
+def iter_chunks(sites, start_timestamp, end_timestamp, chunk_size=5000):
+    """Like db.iter_chunks("extract_data", ...), but over the rows received
+    from the given sites (or all of them, if sites is None), one site after
+    the other. Each site's rows are read through the (site, read_time)
+    index. Yields at least one (possibly empty) chunk."""
+    if sites is None:
+        sites = [site["name"] for site in db.queries.get_sites()]
+    for site in sites:
+        for columns, rows in db.iter_chunks(
+            "extract_sitedata",
+            chunk_size,
+            site=site,
+            start_timestamp=start_timestamp,
+            end_timestamp=end_timestamp,
+        ):
+            if rows:
+                yield columns, rows
+    yield COLUMNS, []
+
+
+def run_sender(args):
+    if not args.token:
+        parser.error("the central node's token is needed (--token or GASMIX_REPLICATION_TOKEN)")
+    db.init()
+    db.migrate()
+    print(f"Replicating to {args.url} as site {args.site}.", file=sys.stderr)
+    delay = args.interval
+    while True:
+        try:
+            sent = send(args.url, args.site, args.token)
+            if sent:
+                print(f"Sent {sent} rows.", file=sys.stderr)
+            delay = args.interval
+        except (OSError, ValueError, KeyError, ReplicationError) as e:
+            # urllib's errors are OSErrors; retry later, backing off up to an hour
+            print("Replication failed:", e, file=sys.stderr)
+            delay = min(2 * delay, 3600)
+        if args.once:
+            return
+        time.sleep(delay)
+
+
+def run_receiver(args):
+    import wsgiref.simple_server
+
+    if not args.token:
+        parser.error("a token for the loggers to send is needed (--token or GASMIX_REPLICATION_TOKEN)")
+    if args.db:
+        db.DB_FILE = args.db
+    db.init()
+    db.migrate()
+    import extract  # the central node is the normal web app, on this database
+
+    extract.REPLICATION_TOKEN = args.token
+
+    print(f"Receiving on port {args.port}, storing in {db.DB_FILE}.", file=sys.stderr)
+    wsgiref.simple_server.make_server("", args.port, extract.app).serve_forever()
+
+
+def main():
+    args = parser.parse_args()
+    if args.command == "send":
+        run_sender(args)
+    else:
+        run_receiver(args)
+
+
+if __name__ == "__main__":
+    main()
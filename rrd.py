@@ -1,48 +1,111 @@
 import os
+import sys
 import rrdtool
 
-RRD_DIR = os.path.expanduser("~/rrd")
-RRD_FILES = [os.path.join(RRD_DIR, "reactor" + str(i) + ".rrd") for i in range(3)]
+import metrics
+
+RRD_DIR = os.environ.get("GASMIX_RRD_DIR", os.path.expanduser("~/rrd"))
+
+# updates go through rrdcached when it is running, see README.md
+RRDCACHED_ADDRESS = os.environ.get("RRDCACHED_ADDRESS", "unix:/var/run/rrdcached.sock")
+
+# seconds of data the rrds hold, see create_rrds()
+RRD_SPAN = 10080 * 60
 
 os.makedirs(RRD_DIR, exist_ok=True)
 
 
-def missing_files():
-    return [f for f in RRD_FILES if not os.path.exists(f)]
+def set_dir(path):
+    """Keep the RRD files in another directory."""
+    global RRD_DIR
+    RRD_DIR = path
+    os.makedirs(RRD_DIR, exist_ok=True)
+
+
+def rrd_file(reactor):
+    return os.path.join(RRD_DIR, "reactor" + str(reactor) + ".rrd")
+
+
+def missing_files(num_reactors):
+    return [rrd_file(i) for i in range(num_reactors) if not os.path.exists(rrd_file(i))]
+
+
+def daemon_args():
+    """rrdtool options for going through rrdcached, or none if it isn't running."""
+    if not RRDCACHED_ADDRESS:
+        return []
+    if RRDCACHED_ADDRESS.startswith("unix:") and not os.path.exists(RRDCACHED_ADDRESS[5:]):
+        return []
+    return ["--daemon", RRDCACHED_ADDRESS]
+
+
+# parts of rrdtool's error messages when rrdcached cannot be reached at all,
+# as opposed to it rejecting the request (e.g. "illegal attempt to update")
+UNREACHABLE_ERRORS = (
+    "unable to connect to rrdcached",
+    "connection refused",
+    "connection reset",
+    "broken pipe",
+    "no such file or directory",
+)
+
+
+def daemon_unreachable(error):
+    message = str(error).lower()
+    return any(part in message for part in UNREACHABLE_ERRORS)
+
+
+def call(func, *args):
+    """Call an rrdtool function via rrdcached if available, and fall back
+    to accessing the files directly if the daemon cannot be reached. Other
+    errors are raised: rrdcached may still hold queued updates for the
+    file, so writing to it directly could apply them out of order."""
+    daemon = daemon_args()
+    if daemon:
+        try:
+            return func(*daemon, *args)
+        except rrdtool.OperationalError as e:
+            if not daemon_unreachable(e):
+                raise
+            print("rrdcached unreachable, using files directly:", e, file=sys.stderr)
+    return func(*args)
 
 
 # helper functions for generating the rrdtool command
 def plot_flow(num, color): 
-    return f"DEF:flow={RRD_FILES[num]}:flow:AVERAGE", \
+    return f"DEF:flow={rrd_file(num)}:flow:AVERAGE", \
             f"LINE2:flow#{color}:Flow (ml/min)", \
             f"GPRINT:flow:LAST:Last\\: %2.1lf ml/min", \
             f"GPRINT:flow:AVERAGE:Avg.\\: %2.1lf ml/min\\n"
 
 def plot_h2(num, color):
-    return f"DEF:h2={RRD_FILES[num]}:h2:AVERAGE", \
+    return f"DEF:h2={rrd_file(num)}:h2:AVERAGE", \
             f"LINE2:h2#{color}:H2 (%) ", \
             f"GPRINT:h2:LAST:      Last\\: %2.1lf%%", \
             f"GPRINT:h2:AVERAGE:Avg.\\: %2.1lf%%\\n"
 
 
 def plot_co2(num, color):
-    return f"DEF:co2={RRD_FILES[num]}:co2:AVERAGE", \
+    return f"DEF:co2={rrd_file(num)}:co2:AVERAGE", \
             f"LINE2:co2#{color}:CO2 (%)", \
             f"GPRINT:co2:LAST:      Last\\: %2.1lf%%", \
             f"GPRINT:co2:AVERAGE:Avg.\\: %2.1lf%%\\n"
 
 
-def create_rrds(files):
+def create_rrds(files, start=None):
     """Create round robin databases with the following fields:
     flow, h2, co2, with 3 minute heartbeats. For storing data every minute.
 
     Two RRAs are used:
     RRA #1: Last available value, 7 days of data available.
     RRA #2: Average value every 30 minutes, 7 days of data available.
+
+    The first update must be later than `start` (default: now - 10 s).
     """
     for file in files:
         rrdtool.create(
             file,
+            *(["--start", str(int(start))] if start is not None else []),
             "--step",
             "60",
             "DS:flow:GAUGE:180:0:5000",
@@ -53,24 +116,60 @@ def create_rrds(files):
         )
 
 
-def record_data(flows, reactor, h2, co2):
-    """Record data to the RRD. Flows are logged for all reactors,
-    H2 and CO2 data only for the current reactor."""
-    for i in range(3):
+def record_data(flows, gas, timestamp=None):
+    """Record data to the RRDs. Flows are logged for all reactors, H2 and
+    CO2 data only for the reactors currently on an analyser, given as a
+    dict of reactor -> (h2, co2). The timestamp defaults to now."""
+    for i in range(len(flows)):
+        h2, co2 = gas.get(i, ("U", "U"))
         upd_string = (
-            "N:"
+            ("N" if timestamp is None else str(int(timestamp)))
+            + ":"
             + str(flows[i])
             + ":"
-            + (str(h2) if i == reactor else "U")
+            + str(h2)
             + ":"
-            + (str(co2) if i == reactor else "U")
+            + str(co2)
         )
-        rrdtool.update(RRD_FILES[i], upd_string)
+        try:
+            with metrics.timer("rrd_update_seconds"):
+                call(rrdtool.update, rrd_file(i), upd_string)
+        except rrdtool.OperationalError as e:
+            # the database is the primary record; a rejected rrd update must
+            # not stop the logger
+            metrics.inc("rrd_errors_total", reactor=i)
+            print(f"RRD update of reactor {i} failed:", e, file=sys.stderr)
+
+
+def update_string(timestamp, flow, h2, co2):
+    """An rrdtool update argument, with missing (None/NaN) values as unknown."""
+    values = ["U" if v is None or v != v else str(v) for v in (flow, h2, co2)]
+    return ":".join([str(int(timestamp)), *values])
+
+
+def rebuild(reactor, rows, start, batch_size=1000):
+    """Recreate a reactor's RRD from (read_time, flow, h2, co2) rows sorted by
+    time and later than `start`, several rows per rrdtool update. The new
+    file is written next to the old one, bypassing rrdcached, and then
+    replaces it; stop the logger first, or its updates will be lost."""
+    file = rrd_file(reactor)
+    new_file = file + ".new"
+    create_rrds([new_file], start=start)
+    for i in range(0, len(rows), batch_size):
+        with metrics.timer("rrd_update_seconds"):
+            rrdtool.update(new_file, *(update_string(*row) for row in rows[i : i + batch_size]))
+    os.replace(new_file, file)
+
+
+def last_update(reactor):
+    """Unix time of the last update of the reactor's RRD."""
+    return call(rrdtool.last, rrd_file(reactor))
 
 
 def custom_rrd_graph(reactor, duration, width=600, height=400):
     """Plots an RRD graph spanning the specified duration (in hours).
-    Returns a PNG graph as bytes."""
+    Returns a PNG graph as bytes. When rrdcached is used, it flushes the
+    reactor's pending updates to disk before the graph is drawn."""
     a = [
         *plot_h2(reactor, "2848FE"),
         *plot_co2(reactor, "4B7B5B"),
@@ -87,4 +186,4 @@ def custom_rrd_graph(reactor, duration, width=600, height=400):
         "Reactor " + str(reactor),
         "-v Flow [ml/min] / H2 [%] / CO2 [%]",
     ]
-    return rrdtool.graphv("-", a)
+    return call(rrdtool.graphv, "-", *a)
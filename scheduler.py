@@ -0,0 +1,47 @@
+# scheduler.py --
+#   fires sampling ticks on absolute monotonic deadlines
+
+import time
+
+
+class Scheduler:
+    """Ticks every `interval` seconds, counted from the first tick, so the
+    time spent on sensor I/O does not make the schedule drift.
+
+    After each tick, `jitter` holds how late the tick fired (seconds) and
+    `max_jitter` the worst case so far. If the work between two ticks took
+    longer than the interval, the missed deadlines are skipped and counted
+    in `overruns`."""
+
+    def __init__(self, interval, clock=time.monotonic, sleep=time.sleep):
+        self.interval = interval
+        self.clock = clock
+        self.sleep = sleep
+        self.start = None
+        self.tick = 0
+        self.jitter = 0.0
+        self.max_jitter = 0.0
+        self.overruns = 0
+
+    def deadline(self, tick):
+        return self.start + tick * self.interval
+
+    def wait(self):
+        """Sleep until the next deadline and return its tick number."""
+        now = self.clock()
+        if self.start is None:
+            self.start = now
+        else:
+            missed = int((now - self.deadline(self.tick)) // self.interval)
+            if missed > 0:
+                self.overruns += missed
+                self.tick += missed
+            delay = self.deadline(self.tick) - now
+            if delay > 0:
+                self.sleep(delay)
+
+        self.jitter = self.clock() - self.deadline(self.tick)
+        self.max_jitter = max(self.max_jitter, self.jitter)
+        tick = self.tick
+        self.tick += 1
+        return tick
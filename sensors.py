@@ -1,68 +1,113 @@
+import time
+import struct
 import minimalmodbus
 from pymodbus.client import ModbusTcpClient, ModbusSerialClient
 from pymodbus.exceptions import ModbusException
 
+import metrics
+from readings import CounterSnapshot, GasReading
+
+
+# register addresses of the floats we care about, each float spans two registers
+VOL_REG = 1
+PRESSURE_REG = 5
+TEMP_REG = 9
+SNAPSHOT_REGS = TEMP_REG + 2 - VOL_REG
+
+
+def regs_to_float(regs):
+    """Decode two registers into a float, with the same (fully reversed)
+    byte order as minimalmodbus.BYTEORDER_LITTLE."""
+    return struct.unpack("<f", struct.pack(">HH", *regs))[0]
+
 
 # minimalmodbus is nice to work with but lacks tcp support,
 # so we use it for serial but pymodbus for tcp
 class BlueVCount(minimalmodbus.Instrument):
-    def get_vol(self):
+    bus = ""  # prefix for the name, to tell counters on different buses apart
+
+    @property
+    def name(self):
+        return f"{self.bus}bluevcount{self.address}"
+
+    def read_snapshot(self):
+        """Read volume, pressure and temperature in a single transaction.
+        Values are NaN if the counter does not respond."""
         try:
-            return self.read_float(1, byteorder=minimalmodbus.BYTEORDER_LITTLE)
-        except minimalmodbus.ModbusException:
-            return float("nan")
+            with metrics.timer("modbus_seconds", device=self.name):
+                regs = self.read_registers(VOL_REG, SNAPSHOT_REGS)
+        except (minimalmodbus.ModbusException, OSError):
+            metrics.inc("modbus_errors_total", device=self.name)
+            regs = None
+        t, read_time = time.monotonic(), time.time()
+        if regs is None:
+            nan = float("nan")
+            return CounterSnapshot(t, read_time, nan, nan, nan)
 
-    def get_temp(self):
+        def val(reg):
+            return regs_to_float(regs[reg - VOL_REG : reg - VOL_REG + 2])
+
+        return CounterSnapshot(t, read_time, val(VOL_REG), val(PRESSURE_REG), val(TEMP_REG))
+
+    def read_value(self, reg):
         try:
-            return self.read_float(9, byteorder=minimalmodbus.BYTEORDER_LITTLE)
+            with metrics.timer("modbus_seconds", device=self.name):
+                return self.read_float(reg, byteorder=minimalmodbus.BYTEORDER_LITTLE)
         except minimalmodbus.ModbusException:
+            metrics.inc("modbus_errors_total", device=self.name)
             return float("nan")
 
+    def get_vol(self):
+        return self.read_value(VOL_REG)
+
+    def get_temp(self):
+        return self.read_value(TEMP_REG)
+
     def get_pressure(self):
-        try:
-            return self.read_float(5, byteorder=minimalmodbus.BYTEORDER_LITTLE)
-        except minimalmodbus.ModbusException:
-            return float("nan")
+        return self.read_value(PRESSURE_REG)
 
 
 # return 'U' for unknown values to be compatible with rrdtool
 class BlueVary(ModbusTcpClient):
+    name = "bluevary"
+
     def check_connection(self):
         if not self.connected:
             self.connect()
 
+    def read_channel(self, slave):
+        try:
+            with metrics.timer("modbus_seconds", device=self.name):
+                val = self.read_holding_registers(0, 2, slave=slave)
+        except (ModbusException, OSError):
+            val = None
+        if val is None or val.isError():
+            metrics.inc("modbus_errors_total", device=self.name)
+            return float("nan")
+        return self.convert_from_registers(
+            [val.registers[1], val.registers[0]], data_type=self.DATATYPE.FLOAT32
+        )
+
     def get_co2(self):
         """CO2 sensor is always channel 1."""
         self.check_connection()
-        try:
-            val = self.read_holding_registers(0, 2, slave=2)
-            return self.convert_from_registers(
-                [val.registers[1], val.registers[0]], data_type=self.DATATYPE.FLOAT32
-            )
-        except:
-            return float("nan")
+        return self.read_channel(2)
 
     def get_h2(self):
         """Assume a H2 sensor on channel 2."""
         self.check_connection()
-        try:
-            val = self.read_holding_registers(0, 2, slave=3)
-            return self.convert_from_registers(
-                [val.registers[1], val.registers[0]], data_type=self.DATATYPE.FLOAT32
-            )
-        except:
-            return float("nan")
+        return self.read_channel(3)
 
     def get_humidity(self):
         """Absolute humidity"""
         self.check_connection()
-        try:
-            val = self.read_holding_registers(0, 2, slave=4)
-            return self.convert_from_registers(
-                [val.registers[1], val.registers[0]], data_type=self.DATATYPE.FLOAT32
-            )
-        except:
-            return float("nan")
+        return self.read_channel(4)
+
+    def read_gas(self):
+        """Read H2, CO2 and humidity, checking the connection only once."""
+        self.check_connection()
+        vals = [self.read_channel(slave) for slave in (3, 2, 4)]
+        return GasReading(time.monotonic(), time.time(), *vals)
 
 
 # bluevcount = BlueVCount('/dev/tty.usbserial-AU05SI5H', slaveaddress=1)
@@ -0,0 +1,156 @@
+# simulate.py --
+#   runs the logger loop against fake sensors and rockers on a virtual clock,
+#   writing to a real database and real RRD files in a separate directory
+
+import os
+import sys
+import math
+import time
+import random
+import argparse
+import tempfile
+from functools import partial
+
+import numpy as np
+
+import db
+import rrd
+import live
+import yields
+import archive
+import metrics
+from main import Channel, run, poll_rate
+from acquire import Acquisition
+from scheduler import Scheduler
+from steady import SteadyStateDetector
+from flow import FlowEstimator
+from devices import GuardedAnalyser, GuardedCounter
+from fake_sensors import VirtualClock, FakeBlueVCount, FakeBlueVary, FakeRockers
+
+
+# flow profiles: base flow (ml/min) and seconds since start -> flow (ml/min)
+def constant(base, t):
+    return base
+
+
+def ramp(base, t):
+    """Start at 20% of the base flow and ramp up to it over three days."""
+    return base * (0.2 + 0.8 * min(1, t / (3 * 86400)))
+
+
+def diurnal(base, t):
+    return base * (1 + 0.3 * math.sin(2 * math.pi * t / 86400))
+
+
+def batch(base, t):
+    """Fermentation-like: rises from zero, peaks at the base flow after a day, then decays."""
+    x = t / 86400
+    return base * x * math.exp(1 - x)
+
+
+PROFILES = {"constant": constant, "ramp": ramp, "diurnal": diurnal, "batch": batch}
+
+parser = argparse.ArgumentParser()
+parser.add_argument("-v", "--verbose", action="store_true", help="Enable verbose mode")
+parser.add_argument("--days", type=float, default=7, help="Simulated duration (default: 7)")
+parser.add_argument("-c", "--cycle-length", type=int, default=60, help="H2/CO2 measuring cycle length (default: 60)")
+parser.add_argument("--flows", type=float, nargs="+", default=[10, 12, 8], help="Base flow per reactor in ml/min, one value per reactor (default: 10 12 8)")
+parser.add_argument("--h2", type=float, nargs="+", default=[70, 60, 65], help="H2 level per reactor in %% (default: 70 60 65)")
+parser.add_argument("--profile", choices=PROFILES, default="constant", help="Flow profile (default: constant)")
+parser.add_argument("--dropout", type=float, default=0, help="Probability that a device read fails and returns NaN (default: 0)")
+parser.add_argument("--analysers", type=int, default=1, help="Number of analysers; the reactors are divided between them in order (default: 1)")
+parser.add_argument("--buses", type=int, default=1, help="Number of counter buses; the counters are divided between them in order (default: 1)")
+parser.add_argument("--bus-latency", type=float, default=0.02, help="Seconds per device transaction (default: 0.02)")
+parser.add_argument("--response-time", type=float, default=5, help="Analyser response time after a switch, in minutes (default: 5)")
+parser.add_argument("--noise", type=float, default=0.2, help="Standard deviation of H2/CO2 readings in %% (default: 0.2)")
+parser.add_argument("-a", "--adaptive", action="store_true", help="Move on to the next reactor when H2/CO2 have settled")
+parser.add_argument("--min-dwell", type=int, default=10, help="Minimum minutes per reactor in adaptive mode (default: 10)")
+parser.add_argument("-p", "--poll-rate", type=poll_rate, default=0, help="Counter polls per second, 0 for one per minute (default: 0)")
+parser.add_argument("--seed", type=int, default=None, help="Random seed")
+parser.add_argument("--dir", default=None, help="Directory for the database and RRD files (default: a new temporary directory)")
+
+
+def main():
+    args = parser.parse_args()
+    if len(args.flows) != len(args.h2):
+        parser.error("--flows and --h2 need the same number of values")
+    num_reactors = len(args.flows)
+    if not 1 <= args.analysers <= num_reactors or not 1 <= args.buses <= num_reactors:
+        parser.error("--analysers and --buses must be between 1 and the number of reactors")
+    random.seed(args.seed)
+
+    out_dir = args.dir or tempfile.mkdtemp(prefix="gasmix-sim-")
+    db.DB_FILE = os.path.join(out_dir, "gasferm.db")
+    rrd.set_dir(os.path.join(out_dir, "rrd"))
+    rrd.RRDCACHED_ADDRESS = ""  # never send simulated data to a running rrdcached
+    metrics.METRICS_FILE = os.path.join(out_dir, "metrics.json")
+    live.LIVE_FILE = os.path.join(out_dir, "live.bin")
+    archive.ARCHIVE_DIR = os.path.join(out_dir, "archive")  # read by yields.update
+    print(f"Simulating {args.days} days, writing to {out_dir}")
+
+    clock = VirtualClock()
+    device = dict(clock=clock, latency=args.bus_latency, dropout=args.dropout)
+
+    # split the reactors into contiguous groups per analyser and per bus, like a config file would
+    def split(n):
+        return [a.tolist() for a in np.array_split(np.arange(num_reactors), n)]
+
+    channels = split(args.analysers)
+    fake_bvs = [
+        FakeBlueVary(response_time=args.response_time * 60, noise=args.noise, **device)
+        for _ in channels
+    ]
+    bvs = [GuardedAnalyser(bv, f"bluevary{i + 1}", clock=clock) for i, bv in enumerate(fake_bvs)]
+    bcs = [
+        GuardedCounter(
+            FakeBlueVCount(flow, profile=partial(PROFILES[args.profile], flow), **device),
+            f"bluevcount{i + 1}",
+            clock=clock,
+        )
+        for i, flow in enumerate(args.flows)
+    ]
+    buses = [[bcs[i] for i in bus] for bus in split(args.buses)]
+    analyser_of = [fake_bvs[c] for c, reactors in enumerate(channels) for _ in reactors]
+    rockers = FakeRockers(analyser_of, args.h2, clock=clock)
+
+    rrd.create_rrds(rrd.missing_files(num_reactors), start=clock.time() - 10)
+    db.init()
+    db.migrate()
+    writer = db.Writer(block=True, on_insert=yields.update)
+    writer.start()
+    acq = Acquisition(bvs, buses)
+
+    sched = Scheduler(60, clock=clock.monotonic, sleep=clock.sleep)
+    estimator = None
+    if args.poll_rate > 0:
+        sched = Scheduler(60 / round(60 * args.poll_rate), clock=clock.monotonic, sleep=clock.sleep)
+        estimator = FlowEstimator(num_reactors, 2 * round(60 * args.poll_rate))
+
+    start = time.monotonic()
+    minutes = int(args.days * 24 * 60)
+    try:
+        run(
+            acq,
+            rockers.activate_rocker,
+            writer,
+            sched,
+            [
+                Channel(bv.name, reactors, SteadyStateDetector() if args.adaptive else None)
+                for bv, reactors in zip(bvs, channels)
+            ],
+            cycle_length=args.cycle_length,
+            verbose=args.verbose,
+            minutes=minutes,
+            min_dwell=args.min_dwell,
+            estimator=estimator,
+        )
+    finally:
+        acq.close()
+        writer.close()
+        rockers.cleanup()
+
+    print(f"Simulated {minutes} cycles in {time.monotonic() - start:.1f} s.", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
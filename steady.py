@@ -0,0 +1,47 @@
+# steady.py --
+#   detects when the gas analyser readings have settled after a rocker switch
+
+import numpy as np
+
+
+class SteadyStateDetector:
+    """Keeps the H2/CO2 readings since the last switch. The readings count as
+    settled when, over the last `window` readings, the least-squares slope of
+    both is below `max_slope` (%/min) and their standard deviation is below
+    `max_std` (%)."""
+
+    def __init__(self, window=5, max_slope=0.05, max_std=0.5):
+        self.window = window
+        self.max_slope = max_slope
+        self.max_std = max_std
+        self.reset()
+
+    def reset(self):
+        self.times = []
+        self.values = []
+
+    def add(self, t, h2, co2):
+        """Add a reading taken at monotonic time t (seconds)."""
+        self.times.append(t)
+        self.values.append((h2, co2))
+
+    def recent(self):
+        return np.array(self.times[-self.window :]), np.array(self.values[-self.window :])
+
+    def settled(self):
+        if len(self.times) < self.window:
+            return False
+        t, y = self.recent()
+        if np.isnan(y).any():
+            return False
+
+        # slope of both columns at once, in %/min
+        x = (t - t.mean()) / 60
+        slopes = x @ (y - y.mean(axis=0)) / (x @ x)
+        return bool(
+            (np.abs(slopes) < self.max_slope).all() and (y.std(axis=0) < self.max_std).all()
+        )
+
+    def value(self):
+        """Mean (H2, CO2) over the last window."""
+        return self.recent()[1].mean(axis=0)
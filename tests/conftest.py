@@ -0,0 +1,30 @@
+# the modules live in the repository root, and load their queries relative to it
+import os
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.chdir(ROOT)
+
+import db  # noqa: E402
+import archive  # noqa: E402
+
+
+@pytest.fixture
+def database(tmp_path, monkeypatch):
+    """An empty database (and archive) of the current schema, in tmp_path."""
+    monkeypatch.setattr(db, "DB_FILE", str(tmp_path / "gasferm.db"))
+    monkeypatch.setattr(db, "queries", None)
+    monkeypatch.setattr(archive, "ARCHIVE_DIR", str(tmp_path / "archive"))
+    db.init()
+    db.migrate()
+    yield db
+    db.queries.engine.dispose()
+
+
+def sensordata(read_time, reactors=range(3), **values):
+    """Sensordata rows (dicts) of the given reactors at one time."""
+    columns = dict(id=None, vol=1.5, h2=None, co2=None, temp=30.0, pressure=None, humidity=None, comment=None)
+    return [dict(columns, read_time=read_time, reactor=reactor, **values) for reactor in reactors]
@@ -0,0 +1,36 @@
+# tests of the web app's TSV export (extract.py)
+
+from datetime import datetime
+
+import pytest
+from falcon import testing
+
+import extract
+from conftest import sensordata
+
+READ_TIME = int(datetime(2024, 1, 1, 12, 0).timestamp())
+
+
+@pytest.fixture
+def client(database):
+    database.insert_rows(sensordata(READ_TIME))
+    return testing.TestClient(extract.app)
+
+
+def export(client, **params):
+    params = dict(start_date="2024-01-01T11:00", end_date="2024-01-01T13:00", **params)
+    resp = client.simulate_get("/extract/extract_tsv", params=params)
+    assert resp.status_code == 200
+    return resp.text.splitlines()
+
+
+def test_export(client):
+    lines = export(client)
+    assert lines[0].split("\t")[:3] == ["id", "read_time", "reactor"]
+    assert len(lines) == 4
+
+
+def test_export_with_empty_site(client):
+    # the export form sends site= when its site field is left empty
+    assert export(client, site="") == export(client)
+    assert export(client, site=",") == export(client)
@@ -0,0 +1,64 @@
+# tests of receiving replicated rows on a central node (replicate.py)
+
+import pytest
+from falcon import testing
+
+import replicate
+from conftest import sensordata
+
+
+def batch(first_id, read_time):
+    rows = sensordata(read_time)
+    for i, row in enumerate(rows):
+        row["id"] = first_id + i
+    return replicate.encode(rows)
+
+
+def test_resent_batch_is_stored_once(database):
+    assert replicate.receive("lab1", batch(1, 1700000000)) == 3
+    assert replicate.receive("lab1", batch(1, 1700000000)) == 3
+    assert replicate.receive("lab1", batch(4, 1700000060)) == 6
+    assert database.queries.get_site_last_id(site="lab1") == 6
+
+
+def test_restarted_ids_are_refused(database):
+    replicate.receive("lab1", batch(1, 1700000000))
+    # e.g. the site's database was recreated: the same ids for other rows
+    with pytest.raises(replicate.ReplicationError):
+        replicate.receive("lab1", batch(1, 1800000000))
+    assert replicate.receive("lab2", batch(1, 1800000000)) == 3
+
+
+@pytest.fixture
+def central(database, monkeypatch):
+    import extract
+
+    monkeypatch.setattr(extract, "REPLICATION_TOKEN", "secret")
+    return testing.TestClient(extract.app)
+
+
+def post(client, body, token="secret", **headers):
+    if token:
+        headers["Authorization"] = f"Bearer {token}"
+    return client.simulate_post("/api/replicate", params={"site": "lab1"}, body=body, headers=headers)
+
+
+def test_replication_needs_the_token(central, monkeypatch):
+    body = batch(1, 1700000000)
+    assert post(central, body, token=None).status_code == 401
+    assert post(central, body, token="wrong").status_code == 401
+    assert post(central, body).json == {"last_id": 3}
+
+    monkeypatch.setattr("extract.REPLICATION_TOKEN", None)
+    assert post(central, body).status_code == 403
+
+
+def test_replication_refuses_bad_batches(central, monkeypatch):
+    body = batch(1, 1700000000)
+    assert post(central, b"not gzip").status_code == 400
+    assert post(central, body[:-10]).status_code == 400
+
+    monkeypatch.setattr("replicate.MAX_DECODED_BYTES", 100)
+    assert post(central, body).status_code == 400
+    monkeypatch.setattr("extract.MAX_BATCH_BYTES", len(body) - 1)
+    assert post(central, body).status_code == 413
@@ -0,0 +1,136 @@
+# webcam.py --
+#   background webcam capture, shared between all web app worker processes
+#
+# only one process at a time holds the capture lock and owns the camera. it writes
+# the latest rotated, jpeg-encoded frame to FRAME_FILE, and all processes serve
+# that file, so requests never touch the camera or encode anything themselves.
+
+import os
+import sys
+import time
+import fcntl
+import tempfile
+import threading
+
+DEVICE = 0
+FPS = float(os.environ.get("GASMIX_WEBCAM_FPS", 1))
+SHM_DIR = "/dev/shm" if os.path.isdir("/dev/shm") else tempfile.gettempdir()
+FRAME_FILE = os.path.join(SHM_DIR, "gasmix-webcam.jpg")
+LOCK_FILE = FRAME_FILE + ".lock"
+
+
+class Grabber(threading.Thread):
+    def __init__(self, device=DEVICE, fps=FPS):
+        super().__init__(name="webcam", daemon=True)
+        self.device = device
+        self.fps = fps
+        self.stopping = threading.Event()
+
+    def run(self):
+        with open(LOCK_FILE, "w") as lock:
+            # wait until no other process is capturing
+            while not self.stopping.is_set():
+                try:
+                    fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                    break
+                except BlockingIOError:
+                    self.stopping.wait(5)
+            else:
+                return
+
+            # only the process that owns the camera needs opencv
+            import cv2
+
+            cap = cv2.VideoCapture(self.device)
+            cap.set(cv2.CAP_PROP_FRAME_WIDTH, 1280)
+            cap.set(cv2.CAP_PROP_FRAME_HEIGHT, 720)
+            cap.set(cv2.CAP_PROP_BUFFERSIZE, 1)  # avoid serving stale buffered frames
+            try:
+                while not self.stopping.is_set():
+                    start = time.monotonic()
+                    ret, frame = cap.read()
+                    if ret:
+                        # rotate the image before storing it
+                        rot_frame = cv2.rotate(frame, cv2.ROTATE_90_CLOCKWISE)
+                        _, img_encoded = cv2.imencode(".jpg", rot_frame)
+                        write_frame(img_encoded.tobytes())
+                    else:
+                        print("Could not read frame from webcam.", file=sys.stderr)
+                    self.stopping.wait(max(0, 1 / self.fps - (time.monotonic() - start)))
+            finally:
+                cap.release()
+
+    def stop(self):
+        self.stopping.set()
+        self.join()
+
+
+def write_frame(data):
+    """Atomically replace the shared frame."""
+    tmp = f"{FRAME_FILE}.{os.getpid()}"
+    with open(tmp, "wb") as f:
+        f.write(data)
+    os.replace(tmp, FRAME_FILE)
+
+
+_frame = (None, None)
+_frame_lock = threading.Lock()
+
+
+def latest_frame():
+    """Returns (frame id, jpeg bytes) of the latest frame, or (None, None) if
+    there is none yet. The file is only re-read when it has changed."""
+    global _frame
+    try:
+        frame_id = os.stat(FRAME_FILE).st_mtime_ns
+    except FileNotFoundError:
+        return None, None
+    with _frame_lock:
+        if _frame[0] != frame_id:
+            with open(FRAME_FILE, "rb") as f:
+                _frame = (frame_id, f.read())
+        return _frame
+
+
+def mjpeg_stream(fps=FPS, heartbeat=5, timeout=30):
+    """Yields a multipart/x-mixed-replace stream of new frames as they arrive.
+    The last frame is sent again every `heartbeat` seconds, which lets the
+    server notice closed connections while the camera is stuck, and the
+    stream ends when there has been no new frame for `timeout` seconds
+    (e.g. there is no camera)."""
+    last_id, data = None, None
+    sent = changed = time.monotonic()
+    while True:
+        frame_id, frame = latest_frame()
+        now = time.monotonic()
+        if frame is not None and frame_id != last_id:
+            last_id, data, changed = frame_id, frame, now
+        elif now - changed >= timeout:
+            return
+        elif data is None or now - sent < heartbeat:
+            time.sleep(1 / (2 * fps))
+            continue
+        sent = now
+        yield b"--frame\r\nContent-Type: image/jpeg\r\nContent-Length: %d\r\n\r\n" % len(data)
+        yield data + b"\r\n"
+
+
+grabber = None
+_grabber_lock = threading.Lock()
+
+
+def start():
+    """Start the capture thread for this process, if it is not already running."""
+    global grabber
+    with _grabber_lock:
+        if grabber is None:
+            grabber = Grabber()
+            grabber.start()
+
+
+def stop():
+    global grabber
+    with _grabber_lock:
+        if grabber is not None:
+            grabber.stop()
+            grabber = None
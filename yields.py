@@ -0,0 +1,213 @@
+# yields.py --
+#   cumulative gas, H2 and CO2 production per reactor. h2/co2 are only
+#   measured while a reactor holds the analyser, so the composition is
+#   interpolated across the minutes in between. running totals are kept in
+#   the yield_index table (see Database.md), so that the production over
+#   any window is the difference of two indexed lookups.
+
+import sys
+
+import numpy as np
+
+import db
+import archive
+
+# seconds; a longer gap between two rows (e.g. the logger was down) counts
+# as one minute of production rather than extrapolating the flow across it
+MAX_GAP = 120
+
+# seconds; a reactor's rows this long after its last measurement (before its
+# latest row) keep the composition they hold, so that each update reads at
+# most this much of its data, even during an analyser outage or for reactors
+# that are never measured. see composition()
+MAX_PROVISIONAL = 6 * 3600
+
+# seconds of data read at a time when catching up
+WINDOW = 30 * 86400
+
+COLUMNS = ["read_time", "vol", "h2", "co2"]
+WRITE_BATCH = 10000
+
+
+def interpolate(t, x):
+    """x with NaNs filled in by linear interpolation in t between the finite
+    values, holding the first/last finite value at the ends. All NaN if
+    there are no finite values."""
+    finite = np.isfinite(x)
+    if not finite.any():
+        return x
+    return np.interp(t, t[finite], x[finite])
+
+
+def composition(t, x):
+    """The H2 or CO2 content x interpolated like interpolate(), except that
+    across more than MAX_PROVISIONAL between two measurements, the first is
+    held until (the last row at or before) MAX_PROVISIONAL before the second,
+    and that the first measurement is held back for only MAX_PROVISIONAL.
+    This gives the same result however the rows are split into updates."""
+    finite = np.isfinite(x)
+    if not finite.any():
+        return x
+    kt, kx = t[finite], x[finite]
+    gaps = np.flatnonzero(np.diff(kt) > MAX_PROVISIONAL)
+    hold = t[np.searchsorted(t, kt[gaps + 1] - MAX_PROVISIONAL, side="right") - 1]
+    y = np.interp(t, np.insert(kt, gaps + 1, hold), np.insert(kx, gaps + 1, kx[gaps]))
+    y[t < kt[0] - MAX_PROVISIONAL] = np.nan
+    return y
+
+
+def production(t, vol, h2, co2):
+    """Gas, H2 and CO2 volumes (ml) produced in the interval leading up to
+    each row. vol is the flow in ml/min, h2/co2 the composition in %, as
+    from composition(). The first row has no interval and produces nothing."""
+    dt = np.diff(t, prepend=t[:1]).astype(float)
+    dt[dt > MAX_GAP] = 60
+    gas = interpolate(t, vol) * dt / 60
+    gas = np.nan_to_num(gas)
+    return gas, gas * h2 / 100, gas * co2 / 100
+
+
+def read_rows(reactor, start, end):
+    """A reactor's rows from start to end (archived and live), as a float
+    array of COLUMNS sorted by read_time."""
+    chunks = [np.empty((0, len(COLUMNS)))]
+    for _, rows in archive.iter_chunks(start, end, columns=COLUMNS, reactor=reactor):
+        if rows:
+            chunks.append(np.array(rows, dtype=float))
+    a = np.concatenate(chunks)
+    return a[np.argsort(a[:, 0], kind="stable")]
+
+
+def data_span():
+    """The first and last read_time in sensordata, archived or not, or
+    (None, None) if there is none."""
+    first, last = db.queries.get_oldest_read_time(), db.queries.get_last_read_time()
+    months = archive.months()
+    if months:
+        first, last = months[0], last or archive.next_month(months[-1])
+    return first, last
+
+
+def update_window(reactor, first, end):
+    """Bring a reactor's yield index up to date with its rows up to `end`.
+    The rows are read from the reactor's anchor on: its last row whose
+    composition was measured, or was fixed as it had not been measured for
+    MAX_PROVISIONAL (or from `first` if there is none yet). Of these rows,
+    only the new ones are written, unless a new measurement changes the
+    interpolated composition of the ones before it. Returns the number of
+    rows written."""
+    anchor = db.queries.get_yield_anchor(reactor=reactor)
+    last_time = db.queries.get_yield_last_time(reactor=reactor)
+    if anchor is None:
+        start, base = first, np.array([0, np.nan, np.nan])
+    else:
+        start = anchor["read_time"]
+        base = np.array([anchor["gas"], anchor["h2"], anchor["co2"]], dtype=float)
+
+    a = read_rows(reactor, start, end)
+    t, vol, h2, co2 = a[:, 0].astype(np.int64), a[:, 1], a[:, 2], a[:, 3]
+    if len(t) == 0:
+        return 0
+    measured = np.isfinite(h2) | np.isfinite(co2)
+    if anchor is not None and t[0] == start:
+        # a fixed anchor holds a composition that was not measured at it
+        h2[0], co2[0] = np.array([anchor["h2_pct"], anchor["co2_pct"]], dtype=float)
+    h2, co2 = composition(t, h2), composition(t, co2)
+
+    # the first row (normally the anchor) produces nothing, so it keeps its
+    # totals. H2/CO2 totals start once the composition is known
+    produced = np.column_stack(production(t, vol, h2, co2))
+    cumulative = np.nan_to_num(base) + np.cumsum(np.nan_to_num(produced), axis=0)
+    known = np.isfinite(np.column_stack([np.zeros(len(t)), h2, co2]))
+    cumulative[~(np.logical_or.accumulate(known) | np.isfinite(base))] = np.nan
+
+    flags = measured.astype(int)
+    write = t > (-1 if last_time is None else last_time)
+    if measured[write].any():
+        write = t > start if anchor is not None else np.ones(len(t), dtype=bool)
+    fixed = np.searchsorted(t, t[-1] - MAX_PROVISIONAL, side="right") - 1
+    if fixed >= 0 and (anchor is None or t[fixed] > start) and not measured[fixed:].any():
+        flags[fixed] = 2
+        write[fixed] = True
+
+    values = np.column_stack([cumulative, h2, co2])[write].tolist()
+    rows = [
+        dict(
+            reactor=reactor,
+            read_time=int(t[i]),
+            gas=g,
+            h2=h,
+            co2=c,
+            measured=int(flags[i]),
+            h2_pct=h2_pct,
+            co2_pct=co2_pct,
+        )
+        for i, (g, h, c, h2_pct, co2_pct) in zip(np.flatnonzero(write), values)
+    ]
+    for i in range(0, len(rows), WRITE_BATCH):
+        with db.queries.transaction():
+            db.queries.upsert_yield_index(rows[i : i + WRITE_BATCH])
+    return len(rows)
+
+
+def update_reactor(reactor, first, last):
+    """Bring a reactor's yield index up to date with sensordata from `first`
+    to `last` (see data_span()), reading at most WINDOW seconds of its data
+    at a time. Returns the number of rows written."""
+    anchor = db.queries.get_yield_anchor(reactor=reactor)
+    start = first if anchor is None else anchor["read_time"]
+    return sum(update_window(reactor, first, end) for end in range(start + WINDOW, last + WINDOW, WINDOW))
+
+
+def update(rows=None):
+    """Update the yield index of the reactors in `rows` (sensordata rows as
+    passed to db.Writer's on_insert), or of all reactors."""
+    if rows is None:
+        resolution = db.ROLLUP_RESOLUTIONS["day"]
+        reactors = [int(r["reactor"]) for r in db.queries.get_reactors(resolution=resolution)]
+    else:
+        reactors = sorted({int(row["reactor"]) for row in rows})
+    first, last = data_span()
+    if not reactors or first is None:
+        return
+    for reactor in reactors:
+        update_reactor(reactor, first, last)
+
+
+def rebuild_from(start):
+    """Recompute the yield index of all reactors from `start` on, e.g. after
+    older rows have been added to sensordata (see backfill.py)."""
+    with db.queries.transaction():
+        db.queries.delete_yield_index_from(start=start)
+    update()
+
+
+def total(reactor, start, end):
+    """Gas, H2 and CO2 (ml) produced by a reactor between start and end, and
+    whether the result is provisional, i.e. extends past the reactor's last
+    composition measurement."""
+    totals = {}
+    for name, t in (("start", start), ("end", end)):
+        row = db.queries.get_yield_at(reactor=reactor, t=t)
+        totals[name] = np.zeros(3) if row is None else np.array(
+            [row["gas"], row["h2"], row["co2"]], dtype=float
+        )
+    gas, h2, co2 = (totals["end"] - totals["start"]).tolist()
+    anchor = db.queries.get_yield_anchor(reactor=reactor)
+    return dict(
+        gas=gas,
+        h2=h2,
+        co2=co2,
+        provisional=anchor is None or end > anchor["read_time"],
+    )
+
+
+def main():
+    db.init()
+    db.migrate()
+    print("Updating the yield index.", file=sys.stderr)
+    update()
+
+
+if __name__ == "__main__":
+    main()